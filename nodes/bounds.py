@@ -0,0 +1,168 @@
+import math
+import numpy as np
+from coverage import polygon_parts
+
+
+def oriented_edges(polygon):
+    """
+    Edges of a polygon, counter-clockwise round the outside and clockwise
+    round the holes
+    """
+    starts = list()
+    ends = list()
+    rings = [polygon.exterior] + list(polygon.interiors)
+    for k, ring in enumerate(rings):
+        coords = np.asarray(ring.coords, dtype=float)[:, :2]
+        xs, ys = coords[:, 0], coords[:, 1]
+        signed = np.dot(xs[:-1], ys[1:]) - np.dot(xs[1:], ys[:-1])
+        if (signed < 0) == (k == 0):
+            coords = coords[::-1]
+        starts.append(coords[:-1])
+        ends.append(coords[1:])
+    return np.concatenate(starts), np.concatenate(ends)
+
+
+def strip_areas(starts, ends, y_lo, y_hi, xs):
+    """
+    Area of a polygon between y_lo and y_hi and left of each of `xs`,
+    given its edges oriented counter-clockwise round the outside. By
+    Green's theorem this is the integral of min(x, a) dy round the
+    boundary. The cuts along the strip are horizontal and add nothing,
+    so the edges only need clipping to the strip.
+    """
+    ya, yb = starts[:, 1], ends[:, 1]
+    live = (ya != yb) & (np.minimum(ya, yb) < y_hi) & \
+        (np.maximum(ya, yb) > y_lo)
+    starts, ends = starts[live], ends[live]
+    ya, dy = starts[:, 1], ends[:, 1] - starts[:, 1]
+    t_lo = (y_lo - ya) / dy
+    t_hi = (y_hi - ya) / dy
+    t0 = np.clip(np.minimum(t_lo, t_hi), 0.0, 1.0)
+    t1 = np.clip(np.maximum(t_lo, t_hi), 0.0, 1.0)
+    dx = ends[:, 0] - starts[:, 0]
+    x0 = starts[:, 0] + t0 * dx
+    x1 = starts[:, 0] + t1 * dx
+    lo = np.minimum(x0, x1)[:, np.newaxis]
+    hi = np.maximum(x0, x1)[:, np.newaxis]
+    a = xs[np.newaxis, :]
+    # x is uniform over [lo, hi] along a clipped edge, so min(x, a)
+    # averages (lo + a) / 2 over the fraction of it left of a, else a
+    span = hi - lo
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(span > 0, np.clip((a - lo) / span, 0.0, 1.0),
+                        a >= lo)
+    mean = frac * (lo + np.clip(a, lo, hi)) / 2 + (1 - frac) * a
+    return ((t1 - t0) * dy).dot(mean)
+
+
+class CoverageBound(object):
+    """
+    Admissible upper bound on the blind-spot area a path can still cover
+    from (x, y) within a remaining time budget. The blind spots are
+    binned once into square cells of `cell_size` metres. Every footprint
+    flown from now on lies inside the disk reachable at `max_speed`, grown
+    by the footprint radius, so only cells touching that disk can still be
+    covered. The bound is also capped by one footprint area per remaining
+    lattice step, plus one for the footprint at (x, y) itself when
+    `include_current` is set.
+    """
+
+    def __init__(self, bs_polys, cell_size, max_speed, step):
+        self.max_speed = max_speed
+        self.set_step(step)
+        self.cell_size = cell_size
+        self.half_diag = cell_size * math.sqrt(0.5)
+        self.origin = (0.0, 0.0)
+        areas = np.zeros((0, 0))
+        if not bs_polys.is_empty:
+            minx, miny, maxx, maxy = bs_polys.bounds
+            self.origin = (minx, miny)
+            cols = max(1, int(math.ceil((maxx - minx) / cell_size)))
+            rows = max(1, int(math.ceil((maxy - miny) / cell_size)))
+            areas = np.zeros((rows, cols))
+            for part in polygon_parts(bs_polys):
+                self.bin_part(areas, part)
+        self.areas = areas
+        self.total = areas.sum()
+        rows, cols = areas.shape
+        # Prefix sums along each row, so a run of cells in a row sums in
+        # O(1) whatever the size of the grid
+        row_sums = np.zeros((rows, cols + 1))
+        np.cumsum(areas, axis=1, out=row_sums[:, 1:])
+        self.row_sums = row_sums.tolist()
+        self.row_centres = (self.origin[1] +
+                            (np.arange(rows) + 0.5) * cell_size).tolist()
+
+    def cell_range(self, lo, hi, origin, count):
+        first = int(math.floor((lo - origin) / self.cell_size))
+        last = int(math.ceil((hi - origin) / self.cell_size)) - 1
+        return max(0, first), min(count - 1, max(first, last))
+
+    def bin_part(self, areas, part):
+        """
+        A part inside one cell is added whole. For larger parts the area
+        of each row of cells left of each column line is integrated from
+        the part's edges, and differenced into the cells of the row.
+        """
+        rows, cols = areas.shape
+        minx, miny, maxx, maxy = part.bounds
+        i0, i1 = self.cell_range(minx, maxx, self.origin[0], cols)
+        j0, j1 = self.cell_range(miny, maxy, self.origin[1], rows)
+        if i0 == i1 and j0 == j1:
+            areas[j0, i0] += part.area
+            return
+        size = self.cell_size
+        x0, y0 = self.origin
+        starts, ends = oriented_edges(part)
+        xs = x0 + np.arange(i0, i1 + 2) * size
+        for j in xrange(j0, j1 + 1):
+            left = strip_areas(starts, ends, y0 + j * size,
+                               y0 + (j + 1) * size, xs)
+            areas[j, i0:i1 + 1] += np.diff(left)
+
+    def set_step(self, step):
+        self.step_time = step / self.max_speed
+
+    def disk_area(self, x, y, radius):
+        """ Blind-spot area of the cells whose centres lie in the disk """
+        rows, cols = self.areas.shape
+        if rows == 0:
+            return 0.0
+        size = self.cell_size
+        x0, y0 = self.origin
+        far_x = max(x - x0, x0 + cols * size - x) - 0.5 * size
+        far_y = max(y - y0, y0 + rows * size - y) - 0.5 * size
+        if far_x * far_x + far_y * far_y <= radius * radius:
+            return self.total
+        j0, j1 = self.centre_range(y - radius, y + radius, y0, rows)
+        if j1 < j0:
+            return 0.0
+        u = (x - x0) / size - 0.5
+        r2 = radius * radius
+        area = 0.0
+        for j in xrange(j0, j1 + 1):
+            dy = self.row_centres[j] - y
+            half = math.sqrt(max(r2 - dy * dy, 0.0)) / size
+            i0 = max(0, int(math.ceil(u - half)))
+            i1 = min(cols - 1, int(math.floor(u + half)))
+            if i1 >= i0:
+                row = self.row_sums[j]
+                area += row[i1 + 1] - row[i0]
+        return area
+
+    def centre_range(self, lo, hi, origin, count):
+        """ Indices of the cells whose centres lie within [lo, hi] """
+        first = int(math.ceil((lo - origin) / self.cell_size - 0.5))
+        last = int(math.floor((hi - origin) / self.cell_size - 0.5))
+        return max(0, first), min(count - 1, last)
+
+    def bound(self, x, y, remaining_time, fp_radius, fp_area,
+              include_current=False):
+        if remaining_time <= 0 and not include_current:
+            return 0.0
+        remaining_time = max(0.0, remaining_time)
+        radius = remaining_time * self.max_speed + fp_radius + self.half_diag
+        steps = math.floor(remaining_time / self.step_time)
+        if include_current:
+            steps += 1
+        return min(self.disk_area(x, y, radius), steps * fp_area)
@@ -4,6 +4,10 @@ from math import cos, sin
 from itertools import product
 
 
+""" Order in which the projected rays are returned as polygon vertices """
+VERTEX_ORDER = [0, 1, 3, 2]
+
+
 class CameraProjection(object):
 
     def __init__(self, fov_x, fov_y):
@@ -18,35 +22,61 @@ class CameraProjection(object):
             x = i * cos(th_h) * sin(th_v) / cos(th_v)
             y = j * sin(th_h)
             z = cos(th_h)
-            ret_xis.append(np.matrix([x, y, z]).T)
-        return ret_xis
+            ret_xis.append([x, y, z])
+        return np.array(ret_xis)
+
+    def get_rays(self, rots_qm, rot_cq, trans_qm, trans_cq):
+        rots_qm = np.asarray(rots_qm, dtype=float).reshape(-1, 3, 3)
+        trans_qm = np.asarray(trans_qm, dtype=float).reshape(-1, 3)
+        rot_cq = np.asarray(rot_cq, dtype=float)
+        trans_cq = np.asarray(trans_cq, dtype=float)
+        if rot_cq.ndim == 3:
+            rots_cq = rot_cq
+        else:
+            rots_cq = rot_cq.reshape(3, 3)[np.newaxis]
+        trans_cq = np.broadcast_to(
+            trans_cq.reshape(-1, 3), (len(rots_qm), 3))
+        centres = np.einsum("nij,nj->ni", rots_qm, trans_cq) + trans_qm
+        rays = np.matmul(np.matmul(rots_qm, rots_cq), self.xis.T)
+        return centres, rays
 
-    def get_lambdas(self, rot_qm, rot_cq, trans_qm, trans_cq):
-        lmds = list()
-        for xi in self.xis:
-            top = np.inner((-(rot_qm * trans_cq + trans_qm)).A1, self.ez)
-            bot = np.inner((rot_qm * rot_cq * xi).A1, self.ez)
-            lmds.append(top / bot)
-        return lmds
+    def get_projections(self, rots_qm, rot_cq, trans_qm, trans_cq):
+        """
+        Projects the camera footprint for a stack of N quad poses at once.
+
+        `rots_qm` is (N, 3, 3) and `trans_qm` is (N, 3). The camera
+        extrinsics `rot_cq` and `trans_cq` are either shared, (3, 3) and
+        (3,), or given per pose, (N, 3, 3) and (N, 3). Returns an (N, 4, 2)
+        array of footprint vertices.
+        """
+        centres, rays = self.get_rays(rots_qm, rot_cq, trans_qm, trans_cq)
+        lmds = -centres[:, 2, np.newaxis] / rays[:, 2, :]
+        verts = centres[:, :2, np.newaxis] + lmds[:, np.newaxis, :] * \
+            rays[:, :2, :]
+        return verts.transpose(0, 2, 1)[:, VERTEX_ORDER, :]
+
+    def get_state_projections(self, states, altitude, rot_cq, trans_cq):
+        """
+        Projects the footprints of an (N, 3) array of level (x, y, yaw)
+        states flown at `altitude`. Returns an (N, 4, 2) array.
+        """
+        rots_qm, trans_qm = self.states_to_extrinsics(states, altitude)
+        return self.get_projections(rots_qm, rot_cq, trans_qm, trans_cq)
 
     def get_projection(self, rot_qm, rot_cq, trans_qm, trans_cq):
-        rot_qm = np.matrix(rot_qm)
-        rot_cq = np.matrix(rot_cq)
-        trans_qm = np.matrix(trans_qm)
-        trans_cq = np.matrix(trans_cq)
-        lmds = self.get_lambdas(rot_qm, rot_cq, trans_qm, trans_cq)
-        hom_qm = self.homogeneous(rot_qm, trans_qm)
-        hom_cq = self.homogeneous(rot_cq, trans_cq)
-        verts = list()
-        for i in xrange(4):
-            lxi = np.concatenate(
-                (lmds[i] * self.xis[i], np.matrix([1])), axis=0)
-            v = np.array(hom_qm * hom_cq * lxi)[:2]
-            verts.append(v)
-        verts = [verts[0], verts[1], verts[3], verts[2]]
-        return verts
-
-    def homogeneous(self, rot, trans):
-        rt = np.concatenate((rot, trans), axis=1)
-        hom = np.concatenate((rt, np.matrix([0, 0, 0, 1])), axis=0)
-        return hom
+        return self.get_projections(rot_qm, rot_cq, trans_qm, trans_cq)[0]
+
+    def states_to_extrinsics(self, states, altitude):
+        states = np.asarray(states, dtype=float).reshape(-1, 3)
+        cs = np.cos(states[:, 2])
+        ss = np.sin(states[:, 2])
+        rots = np.zeros((len(states), 3, 3))
+        rots[:, 0, 0] = cs
+        rots[:, 0, 1] = -ss
+        rots[:, 1, 0] = ss
+        rots[:, 1, 1] = cs
+        rots[:, 2, 2] = 1
+        trans = np.zeros((len(states), 3))
+        trans[:, :2] = states[:, :2]
+        trans[:, 2] = -altitude
+        return rots, trans
@@ -0,0 +1,104 @@
+
+import numpy as np
+
+
+def polygon_edges(polygon):
+    rings = [polygon.exterior] + list(polygon.interiors)
+    starts = list()
+    ends = list()
+    for ring in rings:
+        coords = np.asarray(ring.coords, dtype=float)[:, :2]
+        starts.append(coords[:-1])
+        ends.append(coords[1:])
+    return np.concatenate(starts), np.concatenate(ends)
+
+
+class PreparedPolygon(object):
+    """
+    Polygon prepared once for exact point and segment queries. The edges
+    of all its rings are kept as arrays, so a batch of segments is tested
+    against every edge in one vectorised step. A segment is free when it
+    neither crosses nor touches any edge and its start lies inside, which
+    also rejects segments that graze the boundary. Like the old sampled
+    check, the first and last `margin` of a segment are only tested when
+    that end lies inside, so a pose just outside can still leave it.
+    """
+
+    def __init__(self, polygon, margin=0.05):
+        self.polygon = polygon
+        self.margin = margin
+        self.bounds = polygon.bounds
+        self.edge_starts, self.edge_ends = polygon_edges(polygon)
+        self.edge_dirs = self.edge_ends - self.edge_starts
+
+    def points_inside(self, points):
+        """ Even-odd test of an (N, 2) array of points over all rings """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        xs = points[:, 0, np.newaxis]
+        ys = points[:, 1, np.newaxis]
+        ax, ay = self.edge_starts[:, 0], self.edge_starts[:, 1]
+        dx, dy = self.edge_dirs[:, 0], self.edge_dirs[:, 1]
+        crosses = (ay > ys) != (ay + dy > ys)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_int = ax + (ys - ay) * dx / dy
+        return (crosses & (xs < x_int)).sum(axis=1) % 2 == 1
+
+    def contains(self, point):
+        return self.points_inside(((point[0], point[1]),))[0]
+
+    def segments_free(self, starts, ends):
+        """
+        Collision-free mask for the segments from `starts` to `ends`,
+        given as (N, 2) arrays. Either can be a single point shared by
+        all segments.
+        """
+        starts, ends = np.broadcast_arrays(
+            np.asarray(starts, dtype=float).reshape(-1, 2),
+            np.asarray(ends, dtype=float).reshape(-1, 2))
+        starts, ends, inside = self.trim_outside(starts, ends)
+        px, py = starts[:, 0, np.newaxis], starts[:, 1, np.newaxis]
+        qx, qy = ends[:, 0, np.newaxis], ends[:, 1, np.newaxis]
+        ax, ay = self.edge_starts[:, 0], self.edge_starts[:, 1]
+        bx, by = self.edge_ends[:, 0], self.edge_ends[:, 1]
+        dx, dy = self.edge_dirs[:, 0], self.edge_dirs[:, 1]
+        ex, ey = qx - px, qy - py
+        # Orientations of the segment ends about each edge and vice versa
+        o1 = dx * (py - ay) - dy * (px - ax)
+        o2 = dx * (qy - ay) - dy * (qx - ax)
+        o3 = ex * (ay - py) - ey * (ax - px)
+        o4 = ex * (by - py) - ey * (bx - px)
+        touch = (o1 * o2 <= 0) & (o3 * o4 <= 0)
+        # Collinear pairs only meet if their extents overlap
+        collinear = (o1 == 0) & (o2 == 0)
+        overlap = \
+            (np.maximum(np.minimum(px, qx), np.minimum(ax, bx)) <=
+             np.minimum(np.maximum(px, qx), np.maximum(ax, bx))) & \
+            (np.maximum(np.minimum(py, qy), np.minimum(ay, by)) <=
+             np.minimum(np.maximum(py, qy), np.maximum(ay, by)))
+        hits = touch & (~collinear | overlap)
+        return ~hits.any(axis=1) & inside
+
+    def trim_outside(self, starts, ends):
+        """
+        Moves the segment ends lying outside `margin` inwards. Also returns
+        whether each trimmed start lies inside.
+        """
+        n = len(starts)
+        outside = ~self.points_inside(np.concatenate((starts, ends)))
+        outside = outside.reshape(2, n)
+        if self.margin <= 0 or not outside.any():
+            return starts, ends, ~outside[0]
+        dirs = ends - starts
+        lengths = np.hypot(dirs[:, 0], dirs[:, 1])
+        cut = self.margin / np.maximum(lengths, self.margin)
+        t0 = np.where(outside[0], cut, 0.0)
+        t1 = np.where(outside[1], np.maximum(1.0 - cut, t0), 1.0)
+        starts = starts + t0[:, np.newaxis] * dirs
+        ends = starts + (t1 - t0)[:, np.newaxis] * dirs
+        inside = ~outside[0]
+        inside[outside[0]] = self.points_inside(starts[outside[0]])
+        return starts, ends, inside
+
+    def segment_free(self, start, end):
+        return self.segments_free(((start[0], start[1]),),
+                                  ((end[0], end[1]),))[0]
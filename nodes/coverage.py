@@ -0,0 +1,428 @@
+
+import math
+import numpy as np
+import shapely.geometry as geom
+import shapely.wkb
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+
+""" Number of set bits in every possible byte """
+POPCOUNT = np.array([bin(i).count("1") for i in xrange(256)], dtype=np.uint8)
+
+
+def make_coverage(backend, resolution=0.05):
+    if backend == "shapely":
+        return ShapelyCoverage()
+    elif backend == "indexed":
+        return IndexedCoverage()
+    elif backend == "raster":
+        return RasterCoverage(resolution)
+    raise ValueError("Unknown coverage backend: {}".format(backend))
+
+
+def footprint_bounds(footprints):
+    return (footprints[:, :, 0].min(axis=1), footprints[:, :, 1].min(axis=1),
+            footprints[:, :, 0].max(axis=1), footprints[:, :, 1].max(axis=1))
+
+
+def footprints_box(footprints):
+    """ Box around a stack of footprints, e.g. the disk swept by yaws """
+    pts = np.asarray(footprints, dtype=float).reshape(-1, 2)
+    return geom.box(*(pts.min(axis=0).tolist() + pts.max(axis=0).tolist()))
+
+
+def bounds_overlap(footprints, bounds):
+    """ Mask of which footprints overlap which of the (P, 4) bounds """
+    f_minx, f_miny, f_maxx, f_maxy = footprint_bounds(footprints)
+    bounds = np.asarray(bounds, dtype=float).reshape(-1, 4)
+    return (f_minx[:, np.newaxis] < bounds[:, 2]) & \
+        (f_maxx[:, np.newaxis] > bounds[:, 0]) & \
+        (f_miny[:, np.newaxis] < bounds[:, 3]) & \
+        (f_maxy[:, np.newaxis] > bounds[:, 1])
+
+
+def points_in_ring(xs, ys, ring):
+    inside = np.zeros(np.broadcast(xs, ys).shape, dtype=bool)
+    ring = np.asarray(ring, dtype=float)
+    for (x0, y0), (x1, y1) in zip(ring, np.roll(ring, -1, axis=0)):
+        if y0 == y1:
+            continue
+        crosses = (y0 > ys) != (y1 > ys)
+        x_int = x0 + (ys - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= crosses & (xs < x_int)
+    return inside
+
+
+def points_in_rings(xs, ys, rings):
+    """
+    points_in_ring for a stack of K rings at once, giving K masks over
+    the broadcast shape of xs and ys.
+    """
+    rings = np.asarray(rings, dtype=float)
+    shape = np.broadcast(xs, ys).shape
+    inside = np.zeros((len(rings),) + shape, dtype=bool)
+    ends = np.roll(rings, -1, axis=1)
+    expand = (-1,) + (1,) * len(shape)
+    for j in xrange(rings.shape[1]):
+        x0 = rings[:, j, 0].reshape(expand)
+        y0 = rings[:, j, 1].reshape(expand)
+        x1 = ends[:, j, 0].reshape(expand)
+        y1 = ends[:, j, 1].reshape(expand)
+        crosses = (y0 > ys) != (y1 > ys)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_int = x0 + (ys - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= crosses & (xs < x_int)
+    return inside
+
+
+def polygon_parts(polys):
+    if polys.is_empty:
+        return []
+    if polys.geom_type == "Polygon":
+        return [polys]
+    parts = list()
+    for part in getattr(polys, "geoms", []):
+        parts.extend(polygon_parts(part))
+    return parts
+
+
+class ShapelyCoverage(object):
+    """ Exact coverage computed with Shapely polygon boolean operations """
+
+    def make_region(self, polys):
+        return polys
+
+    def covered_area(self, region, footprint):
+        return region.intersection(geom.Polygon(footprint)).area
+
+    def covered_areas(self, region, footprints):
+        """
+        The region is clipped once to the box around all the footprints
+        and every footprint is scored against that local piece only.
+        """
+        areas = np.zeros(len(footprints))
+        if region.is_empty:
+            return areas
+        local = region.intersection(footprints_box(footprints))
+        if local.is_empty:
+            return areas
+        overlaps = bounds_overlap(footprints, local.bounds)[:, 0]
+        for i in np.flatnonzero(overlaps):
+            areas[i] = self.covered_area(local, footprints[i])
+        return areas
+
+    def residual(self, region, footprint):
+        return region.difference(geom.Polygon(footprint))
+
+    def difference(self, region, polys):
+        return region.difference(polys)
+
+    def dumps(self, region):
+        if region.is_empty:
+            return None
+        return shapely.wkb.dumps(region)
+
+    def loads(self, payload):
+        if payload is None:
+            return geom.GeometryCollection()
+        return shapely.wkb.loads(payload)
+
+
+class IndexedPart(object):
+
+    def __init__(self, poly):
+        self.poly = poly
+        self.prepared = prep(poly)
+        self.area = poly.area
+
+
+class IndexedRoot(object):
+    """
+    Blind-spot parts of one planning update with a single STRtree over
+    them, shared by the root region and every residual derived from it.
+    """
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.area = sum(part.area for part in parts)
+        self.tree = None
+        self.index = None
+        if parts:
+            self.tree = STRtree([part.poly for part in parts])
+            self.index = dict(
+                (id(part.poly), i) for i, part in enumerate(parts))
+
+    def query(self, poly):
+        """ Sorted ids of the parts whose bounding boxes intersect poly """
+        if self.tree is None:
+            return []
+        found = self.tree.query(poly)
+        if len(found) > 0 and not hasattr(found[0], "geom_type"):
+            return sorted(int(i) for i in found)
+        return sorted(self.index[id(g)] for g in found)
+
+
+class IndexedRegion(object):
+    """
+    Blind spots as a sparse override of an IndexedRoot. A residual maps
+    the ids of the root parts it has clipped to their remaining pieces,
+    which is an empty list once a part is fully covered. Queries go
+    through the root tree and then the overrides, so deriving a residual
+    only touches the parts that its footprint hits.
+    """
+
+    def __init__(self, root, overrides=None, area=None):
+        self.root = root
+        self.overrides = overrides if overrides is not None else dict()
+        self.area = root.area if area is None else area
+
+    @property
+    def is_empty(self):
+        return len(self.overrides) == len(self.root.parts) and \
+            not any(self.overrides.itervalues())
+
+    @property
+    def parts(self):
+        parts = list()
+        for i, part in enumerate(self.root.parts):
+            parts.extend(self.overrides.get(i, (part,)))
+        return parts
+
+    @property
+    def bounds(self):
+        parts = self.parts
+        if not parts:
+            return ()
+        bounds = np.array([part.poly.bounds for part in parts])
+        return tuple(bounds[:, :2].min(axis=0)) + \
+            tuple(bounds[:, 2:].max(axis=0))
+
+    def candidates(self, poly):
+        """ (root id, part) pairs for the pieces near poly """
+        found = list()
+        for i in self.root.query(poly):
+            pieces = self.overrides.get(i)
+            if pieces is None:
+                found.append((i, self.root.parts[i]))
+            else:
+                found.extend((i, piece) for piece in pieces)
+        return found
+
+
+class IndexedCoverage(object):
+    """
+    Exact coverage that only clips against the blind-spot parts whose
+    bounding boxes intersect the footprint, so the cost of an evaluation
+    depends on the local density of blind spots rather than their count.
+    """
+
+    def make_region(self, polys):
+        parts = [IndexedPart(p) for p in polygon_parts(polys)]
+        return IndexedRegion(IndexedRoot(parts))
+
+    def covered_area(self, region, footprint):
+        poly = geom.Polygon(footprint)
+        area = 0.0
+        for _, part in region.candidates(poly):
+            if not part.prepared.intersects(poly):
+                continue
+            if part.prepared.within(poly):
+                area += part.area
+            else:
+                area += part.poly.intersection(poly).area
+        return area
+
+    def covered_areas(self, region, footprints):
+        """
+        The parts near the footprints are clipped once to the box around
+        them, and every footprint is scored against the local pieces whose
+        bounds it overlaps.
+        """
+        areas = np.zeros(len(footprints))
+        window = footprints_box(footprints)
+        pieces = list()
+        for _, part in region.candidates(window):
+            if not part.prepared.intersects(window):
+                continue
+            if part.prepared.within(window):
+                pieces.append(part.poly)
+            else:
+                pieces.append(part.poly.intersection(window))
+        if not pieces:
+            return areas
+        overlaps = bounds_overlap(footprints, [p.bounds for p in pieces])
+        for i in np.flatnonzero(overlaps.any(axis=1)):
+            poly = geom.Polygon(footprints[i])
+            areas[i] = sum(pieces[j].intersection(poly).area
+                           for j in np.flatnonzero(overlaps[i]))
+        return areas
+
+    def residual(self, region, footprint):
+        return self.difference(region, geom.Polygon(footprint))
+
+    def difference(self, region, polys):
+        hits = dict()
+        for i, part in region.candidates(polys):
+            if part.prepared.intersects(polys):
+                hits.setdefault(i, list()).append(part)
+        if not hits:
+            return region
+        area = region.area
+        overrides = dict(region.overrides)
+        for i, hit in hits.iteritems():
+            pieces = overrides.get(i, (region.root.parts[i],))
+            kept = [piece for piece in pieces if piece not in hit]
+            for part in hit:
+                area -= part.area
+                for res in polygon_parts(part.poly.difference(polys)):
+                    res_part = IndexedPart(res)
+                    area += res_part.area
+                    kept.append(res_part)
+            overrides[i] = kept
+        return IndexedRegion(region.root, overrides, area)
+
+    def dumps(self, region):
+        return [shapely.wkb.dumps(part.poly) for part in region.parts]
+
+    def loads(self, payload):
+        parts = [IndexedPart(shapely.wkb.loads(p)) for p in payload]
+        return IndexedRegion(IndexedRoot(parts))
+
+
+class RasterGrid(object):
+
+    def __init__(self, minx, miny, resolution, rows, cols):
+        self.minx = minx
+        self.miny = miny
+        self.resolution = resolution
+        self.rows = rows
+        self.cols = cols
+        self.byte_cols = (cols + 7) // 8
+        self.cell_area = resolution * resolution
+
+    def cell_window(self, minx, miny, maxx, maxy):
+        res = self.resolution
+        c0 = max(0, int(math.floor((minx - self.minx) / res)))
+        r0 = max(0, int(math.floor((miny - self.miny) / res)))
+        c1 = min(self.cols, int(math.ceil((maxx - self.minx) / res)))
+        r1 = min(self.rows, int(math.ceil((maxy - self.miny) / res)))
+        # Align the column window to whole bytes of the packed rows
+        c0 = (c0 // 8) * 8
+        c1 = min(self.byte_cols * 8, ((c1 + 7) // 8) * 8)
+        return r0, r1, c0, c1
+
+    def cell_centres(self, r0, r1, c0, c1):
+        xs = self.minx + (np.arange(c0, c1) + 0.5) * self.resolution
+        ys = self.miny + (np.arange(r0, r1) + 0.5) * self.resolution
+        return xs[np.newaxis, :], ys[:, np.newaxis]
+
+    def rasterize(self, polys):
+        bits = np.zeros((self.rows, self.byte_cols), dtype=np.uint8)
+        for poly in polygon_parts(polys):
+            r0, r1, c0, c1 = self.cell_window(*poly.bounds)
+            if r1 <= r0 or c1 <= c0:
+                continue
+            xs, ys = self.cell_centres(r0, r1, c0, c1)
+            mask = points_in_ring(xs, ys, poly.exterior.coords)
+            for interior in poly.interiors:
+                mask &= ~points_in_ring(xs, ys, interior.coords)
+            bits[r0:r1, c0 // 8:c1 // 8] |= np.packbits(mask, axis=1)
+        return bits
+
+
+class RasterRegion(object):
+    """
+    Blind spots rasterized into a bit-packed occupancy grid. A set bit
+    marks a cell whose centre is still unseen.
+    """
+
+    def __init__(self, grid, bits):
+        self.grid = grid
+        self.bits = bits
+        self._area = None
+
+    @property
+    def area(self):
+        if self._area is None:
+            self._area = POPCOUNT[self.bits].sum() * self.grid.cell_area
+        return self._area
+
+    @property
+    def is_empty(self):
+        return not self.bits.any()
+
+    @property
+    def bounds(self):
+        grid = self.grid
+        return (grid.minx, grid.miny,
+                grid.minx + grid.cols * grid.resolution,
+                grid.miny + grid.rows * grid.resolution)
+
+
+class RasterCoverage(object):
+    """
+    Approximate coverage on an occupancy grid with `resolution` metre
+    cells. Footprint coverage is a masked popcount and the residual is an
+    AND-NOT of the footprint mask.
+    """
+
+    def __init__(self, resolution):
+        self.resolution = resolution
+
+    def make_region(self, polys):
+        minx, miny, maxx, maxy = polys.bounds
+        res = self.resolution
+        cols = max(1, int(math.ceil((maxx - minx) / res)))
+        rows = max(1, int(math.ceil((maxy - miny) / res)))
+        grid = RasterGrid(minx, miny, res, rows, cols)
+        return RasterRegion(grid, grid.rasterize(polys))
+
+    def footprint_mask(self, grid, footprint):
+        window = grid.cell_window(*footprint.min(axis=0).tolist() +
+                                  footprint.max(axis=0).tolist())
+        r0, r1, c0, c1 = window
+        if r1 <= r0 or c1 <= c0:
+            return window, None
+        xs, ys = grid.cell_centres(r0, r1, c0, c1)
+        return window, np.packbits(points_in_ring(xs, ys, footprint), axis=1)
+
+    def covered_area(self, region, footprint):
+        (r0, r1, c0, c1), mask = self.footprint_mask(region.grid, footprint)
+        if mask is None:
+            return 0.0
+        bits = region.bits[r0:r1, c0 // 8:c1 // 8]
+        return POPCOUNT[bits & mask].sum() * region.grid.cell_area
+
+    def covered_areas(self, region, footprints):
+        """ All the footprint masks are built in one batch over a window """
+        grid = region.grid
+        footprints = np.asarray(footprints, dtype=float)
+        pts = footprints.reshape(-1, 2)
+        r0, r1, c0, c1 = grid.cell_window(*pts.min(axis=0).tolist() +
+                                          pts.max(axis=0).tolist())
+        if r1 <= r0 or c1 <= c0:
+            return np.zeros(len(footprints))
+        xs, ys = grid.cell_centres(r0, r1, c0, c1)
+        masks = np.packbits(points_in_rings(xs, ys, footprints), axis=2)
+        bits = region.bits[r0:r1, c0 // 8:c1 // 8]
+        counts = POPCOUNT[bits & masks].reshape(len(footprints), -1)
+        return counts.sum(axis=1) * grid.cell_area
+
+    def residual(self, region, footprint):
+        (r0, r1, c0, c1), mask = self.footprint_mask(region.grid, footprint)
+        if mask is None:
+            return region
+        bits = region.bits.copy()
+        bits[r0:r1, c0 // 8:c1 // 8] &= ~mask
+        return RasterRegion(region.grid, bits)
+
+    def difference(self, region, polys):
+        bits = region.bits & ~region.grid.rasterize(polys)
+        return RasterRegion(region.grid, bits)
+
+    def dumps(self, region):
+        return region.grid, region.bits
+
+    def loads(self, payload):
+        return RasterRegion(*payload)
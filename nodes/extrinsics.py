@@ -0,0 +1,60 @@
+
+import time
+import numpy as np
+
+
+class ExtrinsicsCache(object):
+    """
+    Caches a rigid transform, stored as a (rotation, translation) pair,
+    that is expensive to resolve but rarely changes. The transform is
+    re-resolved when it is invalidated or older than `max_age` seconds.
+    `version` only increases when the resolved transform actually changes,
+    and the last good transform is kept if a refresh fails. A failed
+    attempt is stamped like a successful one, so it is only retried once
+    `max_age` has passed.
+    """
+
+    def __init__(self, resolve, max_age=None, clock=time.time):
+        self.resolve = resolve
+        self.max_age = max_age
+        self.clock = clock
+        self.value = None
+        self.stamp = None
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        if not self.is_stale():
+            self.hits += 1
+            return self.value
+        self.misses += 1
+        value = self.resolve()
+        self.stamp = self.clock()
+        if value is None:
+            return self.value
+        if not self.same(self.value, value):
+            self.version += 1
+        self.value = value
+        return value
+
+    def is_stale(self):
+        if self.stamp is None:
+            return True
+        if self.max_age is None or self.max_age <= 0:
+            # Without a refresh period only a missing value is retried
+            return self.value is None
+        return self.clock() - self.stamp >= self.max_age
+
+    def invalidate(self):
+        self.stamp = None
+
+    def same(self, a, b):
+        if a is None or b is None:
+            return False
+        return all(np.allclose(x, y) for x, y in zip(a, b))
+
+    def stats(self):
+        return {"extrinsics_hits": self.hits,
+                "extrinsics_misses": self.misses,
+                "extrinsics_version": self.version}
@@ -0,0 +1,69 @@
+
+import math
+import numpy as np
+
+
+class FootprintTemplate(object):
+    """
+    Footprint of a camera flown level at a fixed altitude. The footprint
+    of a state (x, y, yaw) is then the canonical footprint at the origin
+    rotated by yaw and translated by (x, y). If `yaw_resolution` is given,
+    rotations are looked up in a table of pre-rotated footprints with the
+    yaw snapped to the nearest multiple of the resolution.
+    """
+
+    def __init__(self, canonical, yaw_resolution=None, key=None):
+        self.canonical = np.asarray(canonical, dtype=float).reshape(4, 2)
+        self.key = key
+        self.table = None
+        self.yaw_step = None
+        if yaw_resolution:
+            num_yaws = max(1, int(round(2 * math.pi / yaw_resolution)))
+            self.yaw_step = 2 * math.pi / num_yaws
+            self.table = self.rotate(np.arange(num_yaws) * self.yaw_step)
+
+    def rotate(self, yaws):
+        yaws = np.asarray(yaws, dtype=float).reshape(-1)
+        cs = np.cos(yaws)[:, np.newaxis]
+        ss = np.sin(yaws)[:, np.newaxis]
+        xs = self.canonical[:, 0]
+        ys = self.canonical[:, 1]
+        rotated = np.empty((len(yaws), 4, 2))
+        rotated[:, :, 0] = cs * xs - ss * ys
+        rotated[:, :, 1] = ss * xs + cs * ys
+        return rotated
+
+    def rotated(self, yaws):
+        if self.table is None:
+            return self.rotate(yaws)
+        yaws = np.asarray(yaws, dtype=float).reshape(-1)
+        idxs = np.round(yaws / self.yaw_step).astype(int) % len(self.table)
+        return self.table[idxs]
+
+    def footprints(self, states):
+        states = np.asarray(states, dtype=float).reshape(-1, 3)
+        return self.rotated(states[:, 2]) + states[:, np.newaxis, :2]
+
+    def footprint(self, state):
+        return self.footprints(state)[0]
+
+
+class ProjectedFootprints(object):
+    """
+    Footprints computed with the full camera projection of every state,
+    for when the level-flight template is not wanted.
+    """
+
+    def __init__(self, cam, altitude, rot_cq, trans_cq, key=None):
+        self.cam = cam
+        self.altitude = altitude
+        self.rot_cq = rot_cq
+        self.trans_cq = trans_cq
+        self.key = key
+
+    def footprints(self, states):
+        return self.cam.get_state_projections(
+            states, self.altitude, self.rot_cq, self.trans_cq)
+
+    def footprint(self, state):
+        return self.footprints(state)[0]
@@ -1,13 +1,11 @@
 #!/usr/bin/env python
 
 import rospy
-import camproj
 import math
 import tf
 import numpy as np
-import scipy.optimize as opt
 import shapely.geometry as geom
-import heapq
+import shapely.ops
 import planar
 import roshelper
 from tf.transformations import euler_matrix
@@ -26,9 +24,10 @@ from foresight.msg import PolygonArray
 from foresight.msg import TreeSearchResultMsg
 from foresight.msg import PoseArrayWithTimes
 from foresight.msg import ForesightState
+from foresight.msg import PlannerDiagnostics
+from tf2_msgs.msg import TFMessage
 from point import Point
-from search import SpaceHeapValue
-from search import TreeSearchResult
+from planner_core import PlannerCore
 
 
 """ Default parameters """
@@ -42,70 +41,59 @@ SCAN_POLYGON_TOPIC = "/bounding_poly"
 POSE_ARRAY_TOPIC = "/plan_poses"
 PATH_TOPIC = "/plan_path"
 OPT_INFO_TOPIC = "/optimization_info"
+PLANNER_DIAGNOSTICS_TOPIC = "/optimization_diagnostics"
 PROJECTION_MARKERS_TOPIC = "/projection_markers"
 POSE_ARRAY_WITH_TIMES_TOPIC = "/waypoints"
 SETPOINT_POSE_TOPIC = "/setpoint_pose"
 ODOMETRY_TOPIC = "/odometry/filtered"
 STATE_TOPIC = "/state"
+TF_TOPIC = "/tf"
+TF_STATIC_TOPIC = "/tf_static"
 
 NODE_NAME = "info_planner"
 n = roshelper.Node(NODE_NAME, anonymous=False)
 
 
 @n.entry_point()
-class InfoPlanner(object):
+class InfoPlanner(PlannerCore):
 
     def __init__(self):
         self.init_camera_projection()
-        self.init_planner()
+        PlannerCore.__init__(self)
         self.rate = rospy.Rate(rospy.get_param("~frequency", 100))
-        self.pose = None
-        self.opt_tsr = None
-        self.poly = None
-        self.last_opt = None
-        self.opt_tsr_pubbing = None
-        self.added_opt_thresh = 1.0
-
-    def init_planner(self):
-        self.perc_opt_thresh = rospy.get_param("~optimality_threshold", 0.7)
-        self.max_time = rospy.get_param("~max_execution_time", 5.0)
-        self.max_speed = rospy.get_param("~max_speed", 1.0)
-        self.timeout = rospy.get_param("~timeout", 0.2)
-        self.wait_time = rospy.get_param("~wait_time", 2.0)
-        self.buffer_dist = rospy.get_param("~buffer_dist", 0)
-        self.step = rospy.get_param("~neighbour_dist", 0.3)
-        step = self.step
-        self.nbrs = [(step, 0), (0, step), (-step, 0), (0, -step),
-                     (step, step), (-step, step), (step, -step),
-                     (-step, -step)]
         self.next_pose_dist = rospy.get_param("~next_pose_dist", self.step)
-        self.num_nbrs = rospy.get_param("~num_neighbours", 8)
         self.moved_thresh_dist = rospy.get_param("~moved_thresh_dist", 1.0)
         self.moved_thresh_yaw = rospy.get_param(
             "~moved_thresh_yaw", abs(math.sin(math.pi / 5.0)))
+        self.pose = None
         self.last_pose = None
-        self.seen_polygon = None
         self.enabled = False
-        # self.nbrs = self.get_neighbours()
+        self.last_opt = None
+        self.opt_tsr_pubbing = None
+        self.added_opt_thresh = 1.0
+
+    def get_param(self, name, default):
+        return rospy.get_param("~" + name, default)
+
+    def get_time(self):
+        return rospy.get_time()
+
+    def is_shutdown(self):
+        return rospy.is_shutdown()
+
+    def on_shutdown(self, hook):
+        rospy.on_shutdown(hook)
+
+    def instrument_stages(self):
+        PlannerCore.instrument_stages(self)
+        self.profiler.instrument(self, "lookup_relative_pose", "tf_lookup")
 
     def init_camera_projection(self):
-        fov_v = rospy.get_param("~fov_v", 0.2 * math.pi)
-        fov_h = rospy.get_param("~fov_h", 0.2 * math.pi)
-        self.cam = camproj.CameraProjection(fov_v, fov_h)
         self.map_frame = rospy.get_param("~map_frame", MAP_FRAME)
         self.quad_frame = rospy.get_param("~quad_frame", QUAD_FRAME)
         self.camera_frame = rospy.get_param("~camera_frame", CAM_FRAME)
-        self.altitude = rospy.get_param("~altitude", 1)
         self.tfl = tf.TransformListener()
-
-    def get_neighbours(self):
-        nbrs = list()
-        for i in xrange(self.num_nbrs):
-            angle = i * 2 * math.pi / self.num_nbrs
-            x = self.step * math.cos(angle)
-            y = self.step * math.sin(angle)
-            nbrs.append((x, y))
-        return nbrs
+        self.last_camera_tf = None
 
     def update_publishing_path(self, tsr):
         if tsr is None:
@@ -140,8 +128,7 @@ class InfoPlanner(object):
         yaw_dist = self.yaw_dist(self.last_pose, self.pose)
         if dist < self.moved_thresh_dist and yaw_dist < self.moved_thresh_yaw:
             self.last_pose = self.pose
-            projection = self.get_current_projection()
-            proj = np.array(projection).reshape(4, 2)
+            proj = self.get_current_projection()
             proj_poly = geom.Polygon(proj)
             # if self.seen_polygon is None:
             #     self.seen_polygon = proj_poly
@@ -150,16 +137,42 @@ class InfoPlanner(object):
 
     @n.main_loop(frequency=30)
     def run(self):
-        if self.opt_tsr is not None and self.enabled:
-            self.publish_next_pose(self.opt_tsr.path)
-            self.publish_pose_array(self.opt_tsr.path)
-            self.publish_path(self.opt_tsr.path)
-            self.publish_opt_info(self.opt_tsr)
-            self.publish_opt_proj_markers(self.opt_tsr.path)
+        tsr = self.opt_tsr
+        if tsr is None:
+            tsr = self.get_incumbent()
+        if tsr is not None and self.enabled:
+            self.publish_next_pose(tsr.path)
+            self.publish_pose_array(tsr.path)
+            self.publish_path(tsr.path)
+            self.publish_opt_info(tsr)
+            self.publish_opt_proj_markers(tsr.path)
 
     @n.subscriber(STATE_TOPIC, ForesightState)
     def planner_enabled_sub(self, fs):
         self.enabled = fs.state == ForesightState.PLANNER
+        if not self.enabled:
+            self.interrupt()
+
+    @n.subscriber(TF_TOPIC, TFMessage)
+    def tf_sub(self, tfm):
+        self.check_camera_tf(tfm)
+
+    @n.subscriber(TF_STATIC_TOPIC, TFMessage)
+    def tf_static_sub(self, tfm):
+        self.check_camera_tf(tfm)
+
+    def check_camera_tf(self, tfm):
+        camera_frame = self.camera_frame.lstrip("/")
+        for tfs in tfm.transforms:
+            if tfs.child_frame_id.lstrip("/") != camera_frame:
+                continue
+            tr = tfs.transform.translation
+            rot = tfs.transform.rotation
+            cur_tf = (tfs.header.frame_id, tr.x, tr.y, tr.z,
+                      rot.x, rot.y, rot.z, rot.w)
+            if cur_tf != self.last_camera_tf:
+                self.last_camera_tf = cur_tf
+                self.extrinsics.invalidate()
 
     @n.subscriber(SCAN_POLYGON_TOPIC, PolygonStamped, queue_size=1)
     def scan_polygon_cb(self, ps):
@@ -168,17 +181,23 @@ class InfoPlanner(object):
 
     @n.subscriber(BLIND_SPOTS_TOPIC, PolygonArray, queue_size=1)
     def blind_spots_callback(self, polys):
-        multi_polygon = None
+        geom_polys = list()
         for poly in polys.polygons:
             pts = self.points_to_arrs(poly.points)
-            geom_poly = geom.Polygon(pts)
-            if multi_polygon is None:
-                multi_polygon = geom_poly
-            else:
-                multi_polygon = multi_polygon.union(geom_poly)
+            geom_polys.append(geom.Polygon(pts))
+        multi_polygon = None
+        if geom_polys:
+            multi_polygon = shapely.ops.unary_union(geom_polys)
         tsr = self.find_path(multi_polygon)
+        if tsr is not None and self.profiler is not None:
+            self.publish_diagnostics(tsr)
         self.update_publishing_path(tsr)
 
+    def find_path(self, bs_polys):
+        if bs_polys is None or self.pose is None:
+            return None
+        return self.plan(self.pose_to_geom_point(self.pose), bs_polys)
+
     @n.publisher(PolygonStamped)
     def pub_proj(self, proj):
         poly = PolygonStamped()
@@ -202,19 +221,8 @@ class InfoPlanner(object):
         return pa
 
     def find_next_pose_in_path(self, shvs):
-        min_dist = None
-        cur_i = 0
         cur_pt = self.pose_to_geom_point(self.pose)
-        for i, shv in enumerate(shvs):
-            dist = shv.point.distance(cur_pt)
-            if min_dist is None or dist < min_dist:
-                min_dist = dist
-                cur_i = i
-        if cur_i == len(shvs) - 1:
-            next_i = cur_i
-        else:
-            next_i = cur_i + 1
-        return cur_pt, next_i
+        return cur_pt, self.next_path_index(shvs, cur_pt)
 
     @n.publisher(SETPOINT_POSE_TOPIC, PoseStamped)
     def publish_next_pose(self, shvs):
@@ -249,10 +257,30 @@ class InfoPlanner(object):
         tsr_msg.planner_time = tsr.planner_time
         return tsr_msg
 
+    @n.publisher(PLANNER_DIAGNOSTICS_TOPIC, PlannerDiagnostics, queue_size=1)
+    def publish_diagnostics(self, tsr):
+        diag = PlannerDiagnostics()
+        diag.header.stamp = rospy.Time.now()
+        diag.optimality = tsr.optimality
+        diag.execution_time = tsr.path_exec_time
+        diag.planner_time = tsr.planner_time
+        prof = self.profiler
+        for stage in sorted(prof.times):
+            diag.stage_names.append(stage)
+            diag.stage_times.append(prof.times[stage])
+            diag.stage_calls.append(prof.calls[stage])
+        for name, value in sorted(tsr.stats.items()):
+            if isinstance(value, (bool, int, long, float)):
+                diag.stat_names.append(name)
+                diag.stat_values.append(float(value))
+        return diag
+
     @n.publisher(PROJECTION_MARKERS_TOPIC, MarkerArray)
     def publish_opt_proj_markers(self, shvs):
         markers = MarkerArray()
-        for i, shv in enumerate(shvs):
+        states = [[shv.x, shv.y, shv.yaw] for shv in shvs]
+        projs = self.get_footprints(states)
+        for i, (shv, poly) in enumerate(zip(shvs, projs)):
             marker = Marker()
             marker.header.stamp = rospy.Time.now()
             marker.header.frame_id = self.map_frame
@@ -263,91 +291,19 @@ class InfoPlanner(object):
             marker.lifetime = rospy.Duration(0.1)
             marker.color.a = 1.0
             marker.color.g = 0.8
-            poly = self.get_projection(
-                np.array([shv.point.x, shv.point.y, shv.yaw]))
             for v in poly:
                 marker.points.append(self.arr_to_point32(v))
             marker.points.append(self.arr_to_point32(poly[0]))
             markers.markers.append(marker)
         return markers
 
-    def get_residual_polys(self, pt, yaw, polys):
-        state = np.array([pt.x, pt.y, yaw])
-        projection = self.get_projection(state)
-        proj = np.array(projection).reshape(4, 2)
-        proj_poly = geom.Polygon(proj)
-        if self.seen_polygon is None:
-            res_polys = polys.difference(proj_poly)
-        else:
-            res_polys = polys.difference(proj_poly)\
-                .difference(self.seen_polygon)
-        return res_polys
-
-    def find_path(self, bs_polys):
-        if bs_polys is None or self.pose is None:
-            return None
-        pt = self.pose_to_geom_point(self.pose)
-        first_value = self.make_space_heap_value(pt, bs_polys, 0)
-        hq = [first_value]
-        parents = dict()
-        st = rospy.get_time()
-        while len(hq) > 0 and not rospy.is_shutdown():
-            shv = heapq.heappop(hq)
-            term, res = self.search_terminator(parents, shv, bs_polys, st)
-            if term:
-                return res
-            for nbr_shv in self.propogate_neighbours(shv):
-                parents[nbr_shv] = shv
-                heapq.heappush(hq, nbr_shv)
-
-    def make_space_heap_value(self, pt, bs_polys, t):
-        opt_res = self.find_best_yaw(pt, bs_polys)
-        res_polys = self.get_residual_polys(pt, opt_res.x, bs_polys)
-        val = SpaceHeapValue(pt, -opt_res.fun, res_polys, t, opt_res.x)
-        return val
-
-    def propogate_neighbours(self, shv):
-        for nbr in self.nbrs:
-            nbr_p = Point(shv.point.x + nbr[0], shv.point.y + nbr[1])
-            nt = shv.ct + shv.point.distance(nbr_p) / self.max_speed
-            if self.poly.contains(nbr_p) and nt < self.max_time:
-                yield self.make_space_heap_value(nbr_p, shv.polys, nt)
-
-    def search_terminator(self, parents, shv, bs_polys, start_time):
-        optimality = 1 - shv.polys.area / bs_polys.area
-        planner_time = rospy.get_time() - start_time
-        path = self.backtrack_path(parents, shv)
-        if optimality >= self.perc_opt_thresh or planner_time >= self.timeout:
-            tsr = TreeSearchResult(path, optimality, shv.ct, planner_time)
-            return True, tsr
-        else:
-            return False, None
-
-    def backtrack_path(self, parents, shv):
-        cur = shv
-        path = [shv]
-        while cur in parents.keys() and not rospy.is_shutdown():
-            cur = parents[cur]
-            path.append(cur)
-        return list(reversed(path))
-
-    def find_best_yaw(self, pt, polys):
-        init = math.pi
-        args = (list(pt), polys)
-        options = {"disp": False, "maxiter": None}
-        kwargs = {"options": options, "method": "Bounded", "args": args,
-                  "bounds": (0.0, 2 * math.pi)}
-        opt_res = opt.minimize_scalar(self.yaw_objective, init, **kwargs)
-        return opt_res
-
-    def yaw_objective(self, yaw, state_2d, polys):
-        state = np.array(state_2d + [yaw])
-        projection = self.get_projection(state)
-        proj = np.array(projection).reshape(4, 2)
-        poly = geom.Polygon(proj)
-        return -polys.intersection(poly).area
-
     def get_relative_pose(self, parent_frame, child_frame):
+        ps = self.lookup_relative_pose(parent_frame, child_frame)
+        if ps is None:
+            return PoseStamped()
+        return ps
+
+    def lookup_relative_pose(self, parent_frame, child_frame):
         try:
             self.tfl.waitForTransform(
                 parent_frame, child_frame, rospy.Time(),
@@ -370,7 +326,13 @@ class InfoPlanner(object):
         except Exception:
             s = "No transform from {} to {}".format(parent_frame, child_frame)
             rospy.logwarn(s)
-        return PoseStamped()
+        return None
+
+    def resolve_camera_extrinsics(self):
+        pose_cq = self.lookup_relative_pose(self.quad_frame, self.camera_frame)
+        if pose_cq is None:
+            return None
+        return self.pose_to_matrix(pose_cq)
 
     def get_inverse_pose(self, pose, frame_id):
         pos = pose.pose.position
@@ -391,18 +353,16 @@ class InfoPlanner(object):
     def get_projection(self, state):
         pose_mq = self.state_to_pose(state)
         pose_qm = self.get_inverse_pose(pose_mq, self.quad_frame)
-        pose_cq = self.get_relative_pose(self.quad_frame, self.camera_frame)
         rot_qm, trans_qm = self.pose_to_matrix(pose_qm)
-        rot_cq, trans_cq = self.pose_to_matrix(pose_cq)
+        rot_cq, trans_cq = self.get_camera_extrinsics()
         projection = self.cam.get_projection(rot_qm, rot_cq,
                                              trans_qm, trans_cq)
         return projection
 
     def get_current_projection(self):
         pose_qm = self.get_relative_pose(self.map_frame, self.quad_frame)
-        pose_cq = self.get_relative_pose(self.quad_frame, self.camera_frame)
         rot_qm, trans_qm = self.pose_to_matrix(pose_qm)
-        rot_cq, trans_cq = self.pose_to_matrix(pose_cq)
+        rot_cq, trans_cq = self.get_camera_extrinsics()
         projection = self.cam.get_projection(rot_qm, rot_cq,
                                              trans_qm, trans_cq)
         return projection
@@ -473,14 +433,14 @@ class InfoPlanner(object):
         return p
 
     def pose_to_matrix(self, ps):
-        trans = np.matrix([-ps.pose.position.x,
-                           -ps.pose.position.y,
-                           ps.pose.position.z]).T
+        trans = np.array([-ps.pose.position.x,
+                          -ps.pose.position.y,
+                          ps.pose.position.z])
         r, p, y = euler_from_quaternion([ps.pose.orientation.x,
                                          ps.pose.orientation.y,
                                          ps.pose.orientation.z,
                                          ps.pose.orientation.w])
-        rot = np.matrix(euler_matrix(-r, -p, -y)[:3, :3]).T
+        rot = euler_matrix(-r, -p, -y)[:3, :3].T
         return rot, trans
 
 
@@ -0,0 +1,80 @@
+
+import math
+import random
+
+
+class MCTSNode(object):
+    """
+    Node of the Monte Carlo search tree wrapping a search state. `untried`
+    holds the lattice moves not expanded yet and `value` the sum of the
+    rollout rewards backed up through the node.
+    """
+
+    __slots__ = ("shv", "parent", "children", "untried", "visits", "value")
+
+    def __init__(self, shv, parent, untried):
+        self.shv = shv
+        self.parent = parent
+        self.children = list()
+        self.untried = untried
+        self.visits = 0
+        self.value = 0.0
+
+
+class MonteCarloSearch(object):
+    """
+    UCT search over lattice moves. `moves(shv)` lists the (point, time)
+    moves out of a state, `expand(shv, pt, t)` evaluates the state one of
+    them reaches and `rollout(shv)` scores a cheap random continuation
+    from a state with a reward in [0, 1].
+    """
+
+    def __init__(self, root, moves, expand, rollout, exploration=0.1,
+                 rng=None):
+        self.moves = moves
+        self.expand = expand
+        self.rollout = rollout
+        self.exploration = exploration
+        self.rng = rng if rng is not None else random.Random()
+        self.root = MCTSNode(root, None, list(moves(root)))
+
+    def iterate(self):
+        node = self.select(self.root)
+        if node.untried:
+            node = self.expand_node(node)
+        self.backup(node, self.rollout(node.shv))
+        return node.shv
+
+    def select(self, node):
+        while not node.untried and node.children:
+            log_visits = math.log(node.visits)
+            node = max(node.children,
+                       key=lambda child: self.uct(child, log_visits))
+        return node
+
+    def uct(self, node, log_parent_visits):
+        return node.value / node.visits + \
+            self.exploration * math.sqrt(log_parent_visits / node.visits)
+
+    def expand_node(self, node):
+        i = self.rng.randrange(len(node.untried))
+        node.untried[i], node.untried[-1] = node.untried[-1], node.untried[i]
+        pt, t = node.untried.pop()
+        shv = self.expand(node.shv, pt, t)
+        child = MCTSNode(shv, node, list(self.moves(shv)))
+        node.children.append(child)
+        return child
+
+    def principal_variation(self):
+        path = [self.root.shv]
+        node = self.root
+        while node.children:
+            node = max(node.children, key=lambda child: child.visits)
+            path.append(node.shv)
+        return path
+
+    def backup(self, node, reward):
+        while node is not None:
+            node.visits += 1
+            node.value += reward
+            node = node.parent
@@ -0,0 +1,75 @@
+import time
+import multiprocessing
+
+
+""" Yaw optimizer installed in each worker by the pool initializer """
+worker_optimizer = None
+
+
+def init_worker(optimizer):
+    global worker_optimizer
+    worker_optimizer = optimizer
+
+
+def evaluate_neighbours(task):
+    payload, pts = task
+    polys = worker_optimizer.coverage.loads(payload)
+    evals = list()
+    for pt in pts:
+        opt_res = worker_optimizer.find_best_yaw(pt, polys)
+        evals.append((float(opt_res.x), float(-opt_res.fun),
+                      int(opt_res.nfev)))
+    return evals
+
+
+class ParallelExpander(object):
+    """
+    Evaluates the best yaw and coverage gain of neighbour states on a
+    pool of worker processes. Each job is the residual region of a parent,
+    serialized once by its coverage backend, and the neighbour points to
+    evaluate against it. The yaw optimizer is sent to the workers once,
+    when the pool is started, and the pool is restarted when it changes.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = None
+        self.optimizer = None
+        self.stale = None
+
+    def start(self, optimizer):
+        self.close()
+        self.pool = multiprocessing.Pool(
+            self.workers, init_worker, (optimizer,))
+        self.optimizer = optimizer
+
+    def evaluate(self, optimizer, jobs, timeout):
+        """
+        Returns the evaluations of each job, or None if they are not all
+        done within `timeout` seconds. An abandoned batch usually drains
+        while the planner is idle, so stopping its workers at the deadline
+        would only delay the result. The pool is restarted at the next
+        call instead if the batch is still running, so it never holds up
+        a new dispatch.
+        """
+        deadline = time.time() + timeout
+        if self.stale is not None and not self.stale.ready():
+            self.close()
+        self.stale = None
+        if self.pool is None or optimizer is not self.optimizer:
+            self.start(optimizer)
+        tasks = [(optimizer.coverage.dumps(region), pts)
+                 for region, pts in jobs]
+        result = self.pool.map_async(evaluate_neighbours, tasks, chunksize=1)
+        try:
+            return result.get(max(deadline - time.time(), 0.0))
+        except multiprocessing.TimeoutError:
+            self.stale = result
+            return None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+            self.optimizer = None
+        self.stale = None
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import argparse
+import resource
+import multiprocessing
+import numpy as np
+import yaml
+import shapely.geometry as geom
+import shapely.ops
+from point import Point
+from planner_core import PlannerCore
+
+
+""" Default locations, relative to this file """
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PARAMS_FILE = os.path.join(BASE_DIR, "param", "planner.yaml")
+SCENARIO_DIR = os.path.join(BASE_DIR, "benchmark", "scenarios")
+
+
+def load_yaml(path):
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def load_scenario(path):
+    """
+    A scenario holds the start position, the bounding polygon and blind
+    spots in the map frame, and the camera extrinsics as the (rot_cq,
+    trans_cq) pair used by camproj. Optional `params` override planner
+    parameters for this scenario only.
+    """
+    scenario = load_yaml(path)
+    scenario.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+    scenario.setdefault("params", dict())
+    return scenario
+
+
+def run_scenario(scenario, params):
+    params = dict(params, **scenario["params"])
+    ext = scenario.get("camera_extrinsics")
+    if ext is not None:
+        ext = (np.array(ext["rotation"], dtype=float),
+               np.array(ext["translation"], dtype=float))
+    core = PlannerCore(params, camera_extrinsics=ext)
+    core.poly = geom.Polygon(scenario["bounding_polygon"]).buffer(
+        -core.buffer_dist)
+    bs_polys = shapely.ops.unary_union(
+        [geom.Polygon(pts) for pts in scenario["blind_spots"]])
+    tsr = core.plan(Point(*scenario["start"][:2]), bs_polys)
+    if core.expander is not None:
+        core.expander.close()
+    stats = tsr.stats
+    result = {"optimality": float(tsr.optimality),
+              "planner_time": float(tsr.planner_time),
+              "path_exec_time": float(tsr.path_exec_time),
+              "path_length": len(tsr.path),
+              "expanded_nodes": int(stats["expanded_nodes"]),
+              "yaw_searches": int(stats["yaw_searches"]),
+              "objective_evals": int(stats["objective_evals"]),
+              "peak_rss_kb": resource.getrusage(
+                  resource.RUSAGE_SELF).ru_maxrss}
+    if core.profiler is not None:
+        result["stage_times"] = dict(core.profiler.times)
+    return result
+
+
+def run_isolated(conn, scenario, params):
+    conn.send(run_scenario(scenario, params))
+    conn.close()
+
+
+def run_in_process(scenario, params):
+    """ Runs in a fresh process so peak memory is the scenario's own """
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(
+        target=run_isolated, args=(child_conn, scenario, params))
+    proc.start()
+    result = parent_conn.recv()
+    proc.join()
+    return result
+
+
+def summarize(runs):
+    times = np.array([run["planner_time"] for run in runs])
+    opts = np.array([run["optimality"] for run in runs])
+    rates = np.array([run["expanded_nodes"] / max(run["planner_time"], 1e-9)
+                      for run in runs])
+    return {"runs": len(runs),
+            "optimality_mean": float(opts.mean()),
+            "optimality_min": float(opts.min()),
+            "planner_time_mean": float(times.mean()),
+            "planner_time_p50": float(np.percentile(times, 50)),
+            "planner_time_p90": float(np.percentile(times, 90)),
+            "planner_time_max": float(times.max()),
+            "expansions_per_s": float(rates.mean()),
+            "yaw_searches_mean": float(np.mean(
+                [run["yaw_searches"] for run in runs])),
+            "peak_rss_mb": max(run["peak_rss_kb"] for run in runs) / 1024.0}
+
+
+def format_table(summaries):
+    header = "{:<12} {:>4} {:>7} {:>7} {:>8} {:>8} {:>8} {:>9} {:>8}".format(
+        "scenario", "runs", "opt", "opt_min", "t_p50", "t_p90", "t_max",
+        "exp/s", "rss_mb")
+    lines = [header, "-" * len(header)]
+    row = "{:<12} {:>4} {:>7.3f} {:>7.3f} {:>8.3f} {:>8.3f} {:>8.3f} " \
+        "{:>9.1f} {:>8.1f}"
+    for name, s in summaries:
+        lines.append(row.format(
+            name[:12], s["runs"], s["optimality_mean"], s["optimality_min"],
+            s["planner_time_p50"], s["planner_time_p90"],
+            s["planner_time_max"], s["expansions_per_s"], s["peak_rss_mb"]))
+    return "\n".join(lines)
+
+
+def parse_override(text):
+    name, _, value = text.partition("=")
+    return name, yaml.safe_load(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Headless benchmark of the info planner search on "
+        "fixture scenarios, without a ROS master.")
+    parser.add_argument("scenarios", nargs="*",
+                        help="scenario files (default: all in {})".format(
+                            SCENARIO_DIR))
+    parser.add_argument("--params", default=PARAMS_FILE,
+                        help="planner parameter file")
+    parser.add_argument("--set", dest="overrides", action="append",
+                        default=[], type=parse_override,
+                        metavar="NAME=VALUE", help="override a parameter")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="runs per scenario")
+    parser.add_argument("--output", help="write per-run results as YAML")
+    args = parser.parse_args()
+
+    params = load_yaml(args.params) or dict()
+    params.update(dict(args.overrides))
+    paths = args.scenarios or sorted(
+        glob.glob(os.path.join(SCENARIO_DIR, "*.yaml")))
+    results = dict()
+    summaries = list()
+    all_runs = list()
+    for path in paths:
+        scenario = load_scenario(path)
+        runs = [run_in_process(scenario, params)
+                for _ in xrange(args.repeats)]
+        results[scenario["name"]] = runs
+        summaries.append((scenario["name"], summarize(runs)))
+        all_runs.extend(runs)
+    if all_runs:
+        summaries.append(("all", summarize(all_runs)))
+    print(format_table(summaries))
+    if args.output:
+        with open(args.output, "w") as f:
+            yaml.safe_dump({"params": params, "runs": results,
+                            "summary": dict(summaries)}, f)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,748 @@
+
+import atexit
+import camproj
+import heapq
+import math
+import random
+import threading
+import time
+import numpy as np
+import shapely.geometry as geom
+from shapely.prepared import prep
+from point import Point
+from extrinsics import ExtrinsicsCache
+from footprint import FootprintTemplate
+from footprint import ProjectedFootprints
+from yaw_search import YawOptimizer
+from parallel import ParallelExpander
+from bounds import CoverageBound
+from mcts import MonteCarloSearch
+from profiling import StageProfiler
+from coverage import make_coverage
+from residual import ResidualStore
+from search import ClosedSet
+from search import Incumbent
+from search import SpaceHeapValue
+from search import TreeSearchResult
+from search import TranspositionTable
+from search import SearchTree
+
+
+class PlannerCore(object):
+    """
+    Coverage path planning without ROS. Parameters are read from the
+    `params` dict under the same names as the node's private parameters,
+    and `camera_extrinsics` is a fixed (rot_cq, trans_cq) pair, or None
+    for a camera aligned with the quad. InfoPlanner overrides the hooks
+    below to take these from the parameter server, the ROS clock and TF.
+    """
+
+    def __init__(self, params=None, camera_extrinsics=None):
+        self.params = params if params is not None else dict()
+        self.camera_extrinsics = camera_extrinsics
+        self.poly = None
+        self.seen_polygon = None
+        self.opt_tsr = None
+        self.init_camera_model()
+        self.init_planner()
+        self.profiler = None
+        if self.get_param("profiling", False):
+            self.profiler = StageProfiler()
+            self.instrument_stages()
+
+    def get_param(self, name, default):
+        return self.params.get(name, default)
+
+    def get_time(self):
+        return time.time()
+
+    def is_shutdown(self):
+        return False
+
+    def on_shutdown(self, hook):
+        atexit.register(hook)
+
+    def resolve_camera_extrinsics(self):
+        return self.camera_extrinsics
+
+    def instrument_stages(self):
+        prof = self.profiler
+        prof.instrument(self, "plan", "plan")
+        prof.instrument(self, "get_search_root", "root_setup")
+        prof.instrument(self, "init_bound", "bound_setup")
+        prof.instrument(self, "evaluate_state", "yaw_search")
+        for method in ("pop_open", "push_open", "add_node", "discard_node",
+                       "prune_open_list", "trim_beam"):
+            prof.instrument(self, method, "open_list")
+        prof.instrument(self, "rollout", "rollout")
+        prof.instrument(self, "get_camera_extrinsics", "extrinsics")
+        prof.instrument(self.residuals, "materialize", "residual_replay")
+        if self.expander is not None:
+            # The coverage backend is pickled to the workers with the
+            # yaw optimizer, so its methods are left unwrapped
+            prof.instrument(self.expander, "evaluate", "parallel_eval")
+            return
+        prof.instrument(self.coverage, "covered_area", "coverage_query")
+        prof.instrument(self.coverage, "covered_areas", "coverage_query")
+        prof.instrument(self.coverage, "residual", "coverage_update")
+        prof.instrument(self.coverage, "difference", "coverage_update")
+
+    def init_camera_model(self):
+        fov_v = self.get_param("fov_v", 0.2 * math.pi)
+        fov_h = self.get_param("fov_h", 0.2 * math.pi)
+        self.cam = camproj.CameraProjection(fov_v, fov_h)
+        self.altitude = self.get_param("altitude", 1)
+        self.extrinsics = ExtrinsicsCache(
+            self.resolve_camera_extrinsics,
+            max_age=self.get_param("extrinsics_refresh_period", 5.0),
+            clock=self.get_time)
+        self.use_templates = self.get_param("footprint_templates", True)
+        self.template_yaw_res = self.get_param(
+            "footprint_yaw_resolution", 0.0)
+        self.footprint_model = None
+
+    def init_planner(self):
+        self.perc_opt_thresh = self.get_param("optimality_threshold", 0.7)
+        self.max_time = self.get_param("max_execution_time", 5.0)
+        self.max_speed = self.get_param("max_speed", 1.0)
+        self.timeout = self.get_param("timeout", 0.2)
+        self.wait_time = self.get_param("wait_time", 2.0)
+        self.buffer_dist = self.get_param("buffer_dist", 0)
+        self.neighbour_dist = self.get_param("neighbour_dist", 0.3)
+        self.set_lattice(self.neighbour_dist)
+        self.num_nbrs = self.get_param("num_neighbours", 8)
+        self.yaw_search = self.get_param("yaw_search", "bounded")
+        self.yaw_grid_size = self.get_param("yaw_grid_size", 16)
+        self.yaw_refine_top = self.get_param("yaw_refine_top", 2)
+        self.yaw_max_evals = self.get_param("yaw_max_evals", 32)
+        self.coverage = make_coverage(
+            self.get_param("coverage_backend", "shapely"),
+            self.get_param("raster_resolution", 0.05))
+        self.residuals = ResidualStore(
+            self.apply_footprint,
+            capacity=self.get_param("residual_cache_size", 256),
+            lazy=self.get_param("lazy_residuals", True))
+        self.transpositions = TranspositionTable(
+            self.get_param("transposition_table_size", 4096))
+        self.tt_cell_size = self.get_param("transposition_cell_size", 0.05)
+        self.use_closed_set = self.get_param("closed_set", True)
+        self.closed = ClosedSet()
+        self.incremental = self.get_param("incremental_replanning", False)
+        self.last_bs_polys = None
+        self.yaw_optimizer = None
+        self.parallel_workers = self.get_param("parallel_workers", 1)
+        self.parallel_batch = self.get_param("parallel_batch", 8)
+        self.expander = None
+        if self.parallel_workers > 1:
+            self.expander = ParallelExpander(self.parallel_workers)
+            self.on_shutdown(self.expander.close)
+        self.search_mode = self.get_param("search_mode", "best_first")
+        self.beam_width = self.get_param("beam_width", 32)
+        self.mcts_iterations = self.get_param("mcts_iterations", 0)
+        self.mcts_exploration = self.get_param("mcts_exploration", 0.1)
+        self.mcts_rollout_depth = self.get_param("mcts_rollout_depth", 5)
+        num_yaws = self.get_param("mcts_rollout_yaws", 4)
+        self.rollout_yaws = np.arange(num_yaws) * 2 * math.pi / num_yaws
+        self.mcts_rollout_epsilon = self.get_param(
+            "mcts_rollout_epsilon", 0.2)
+        self.mcts_rng = random.Random(self.get_param("mcts_seed", 0))
+        self.max_open_nodes = self.get_param("max_open_nodes", 0)
+        self.informed = self.get_param("informed_search", False)
+        self.bound_cell_size = self.get_param("bound_cell_size", 0.5)
+        self.coverage_bound = None
+        self.multi_resolution = self.get_param("multi_resolution", False)
+        self.lattice_steps = self.get_param(
+            "lattice_steps", [2 * self.step, self.step])
+        self.lattice_budgets = self.get_param(
+            "lattice_budgets", [0.5 * self.timeout, 0.5 * self.timeout])
+        self.search_timeout = self.timeout
+        self.incumbent = Incumbent(clock=self.get_time)
+        self.interrupted = threading.Event()
+        self.search_stats = self.make_search_stats()
+        # self.nbrs = self.get_neighbours()
+
+    def set_lattice(self, step, corridor=None):
+        self.step = step
+        self.nbrs = [(step, 0), (0, step), (-step, 0), (0, -step),
+                     (step, step), (-step, step), (step, -step),
+                     (-step, -step)]
+        self.corridor = corridor
+
+    def get_neighbours(self):
+        nbrs = list()
+        for i in xrange(self.num_nbrs):
+            angle = i * 2 * math.pi / self.num_nbrs
+            x = self.step * math.cos(angle)
+            y = self.step * math.sin(angle)
+            nbrs.append((x, y))
+        return nbrs
+
+    def get_residual_polys(self, pt, yaw, polys):
+        state = np.array([pt.x, pt.y, yaw])
+        return self.apply_footprint(polys, self.get_footprint(state))
+
+    def apply_footprint(self, polys, footprint):
+        res_polys = self.coverage.residual(polys, footprint)
+        if self.seen_polygon is not None:
+            res_polys = self.coverage.difference(res_polys, self.seen_polygon)
+        return res_polys
+
+    def plan(self, pt, bs_polys):
+        if self.profiler is not None:
+            self.profiler.reset()
+        self.search_stats = self.make_search_stats()
+        self.interrupted.clear()
+        root = self.get_search_root(bs_polys)
+        self.incumbent.start(None, root.area, self.get_time())
+        if self.multi_resolution:
+            return self.multi_resolution_search(pt, root)
+        seeds = self.previous_path_seeds(pt)
+        return self.search_lattice(pt, root, seeds, self.timeout)
+
+    def multi_resolution_search(self, pt, root):
+        seeds = self.previous_path_seeds(pt)
+        deadline = 0.0
+        corridor = None
+        levels = zip(self.lattice_steps, self.lattice_budgets)
+        for level, (step, budget) in enumerate(levels):
+            self.set_lattice(step, corridor)
+            deadline += budget
+            tsr = self.search_lattice(pt, root, seeds, deadline)
+            if level == len(levels) - 1 or self.search_interrupted() or \
+                    tsr.optimality >= self.perc_opt_thresh:
+                break
+            seeds = tsr.path[1:]
+            corridor = self.make_corridor(tsr.path, step)
+        self.set_lattice(self.neighbour_dist)
+        return tsr
+
+    def make_corridor(self, path, width):
+        pts = [(shv.x, shv.y) for shv in path]
+        if len(pts) > 1:
+            return prep(geom.LineString(pts).buffer(width))
+        return prep(geom.Point(pts[0]).buffer(width))
+
+    def search_lattice(self, pt, root, seeds, timeout):
+        self.search_stats["lattice_levels"] += 1
+        self.search_timeout = timeout
+        self.closed.clear()
+        tree = SearchTree()
+        first_value = tree.add(self.make_space_heap_value(pt, root, 0))
+        open_list = [first_value]
+        self.incumbent.restart(tree)
+        for shv, parent in self.seed_path(first_value, seeds):
+            open_list.append(tree.add(shv, parent))
+        for shv in open_list:
+            self.incumbent.offer(shv)
+        self.init_bound()
+        if self.search_mode == "beam":
+            return self.beam_search(tree, open_list)
+        elif self.search_mode == "mcts":
+            return self.mcts_search(tree, open_list)
+        return self.best_first_search(tree, open_list)
+
+    def best_first_search(self, tree, open_list):
+        hq = [tree.heap_item(shv) for shv in open_list]
+        heapq.heapify(hq)
+        batch_size = self.parallel_batch if self.expander is not None else 1
+        while len(hq) > 0 and not self.search_interrupted():
+            batch = list()
+            while len(hq) > 0 and len(batch) < batch_size:
+                shv = self.pop_open(tree, hq)
+                if self.search_terminator():
+                    return self.make_result(self.get_search_stats())
+                if self.closed_prune(shv) or self.bound_prune(shv):
+                    self.discard_node(tree, shv)
+                    continue
+                self.close(shv)
+                batch.append(shv)
+            for shv, nbr_shv in self.propogate_frontier(batch):
+                self.add_node(tree, nbr_shv, shv)
+                self.incumbent.offer(nbr_shv)
+                if self.closed_prune(nbr_shv) or self.bound_prune(nbr_shv):
+                    self.discard_node(tree, nbr_shv)
+                    continue
+                self.push_open(tree, hq, nbr_shv)
+            for shv in batch:
+                # Expanded, so only its children and the incumbent need it
+                self.discard_node(tree, shv)
+            hq = self.prune_open_list(tree, hq)
+        return self.make_result(self.get_search_stats())
+
+    def pop_open(self, tree, hq):
+        return tree.get(heapq.heappop(hq))
+
+    def push_open(self, tree, hq, shv):
+        heapq.heappush(hq, tree.heap_item(shv))
+
+    def add_node(self, tree, shv, parent):
+        return tree.add(shv, parent)
+
+    def discard_node(self, tree, shv):
+        tree.discard(shv.node_id)
+
+    def prune_open_list(self, tree, hq):
+        stats = self.search_stats
+        stats["peak_open_nodes"] = max(stats["peak_open_nodes"], len(hq))
+        max_open = self.max_open_nodes
+        if max_open <= 0 or len(hq) <= max_open + max(1, max_open // 4):
+            return hq
+        kept = heapq.nsmallest(max_open, hq)
+        kept_ids = set(node_id for _, node_id in kept)
+        for _, node_id in hq:
+            if node_id not in kept_ids:
+                tree.discard(node_id)
+        stats["pruned_nodes"] += len(hq) - len(kept)
+        return kept
+
+    def init_bound(self):
+        canonical = self.get_footprint([0, 0, 0])
+        self.fp_radius = np.hypot(canonical[:, 0], canonical[:, 1]).max()
+        self.fp_area = geom.Polygon(canonical).area
+        if not self.informed:
+            return
+        if self.coverage_bound is None:
+            self.coverage_bound = CoverageBound(
+                self.last_bs_polys, self.bound_cell_size, self.max_speed,
+                self.step)
+        else:
+            self.coverage_bound.set_step(self.step)
+
+    def bound_prune(self, shv):
+        incumbent = self.incumbent.node
+        if not self.informed or shv is incumbent:
+            return False
+        remaining = self.max_time - shv.ct
+        gain_bound = self.coverage_bound.bound(
+            shv.x, shv.y, remaining, self.fp_radius, self.fp_area)
+        if shv.priority - gain_bound >= incumbent.priority:
+            self.search_stats["bound_pruned"] += 1
+            return True
+        return False
+
+    def bound_prune_state(self, shv, pt, t):
+        if not self.informed:
+            return False
+        gain_bound = self.coverage_bound.bound(
+            pt.x, pt.y, self.max_time - t, self.fp_radius, self.fp_area,
+            include_current=True)
+        if shv.priority - gain_bound >= self.incumbent.node.priority:
+            self.search_stats["bound_pruned"] += 1
+            return True
+        return False
+
+    def beam_search(self, tree, layer):
+        while len(layer) > 0 and not self.search_interrupted():
+            if self.search_terminator():
+                return self.make_result(self.get_search_stats())
+            for shv in layer:
+                self.close(shv)
+            children = list()
+            for shv, nbr_shv in self.propogate_frontier(layer):
+                self.add_node(tree, nbr_shv, shv)
+                self.incumbent.offer(nbr_shv)
+                if self.closed_prune(nbr_shv) or self.bound_prune(nbr_shv):
+                    self.discard_node(tree, nbr_shv)
+                else:
+                    children.append(nbr_shv)
+                if self.incumbent.elapsed() >= self.search_timeout:
+                    break
+            for shv in layer:
+                self.discard_node(tree, shv)
+            layer = self.trim_beam(tree, children)
+        return self.make_result(self.get_search_stats())
+
+    def trim_beam(self, tree, children):
+        children.sort(key=lambda shv: shv.priority)
+        for shv in children[self.beam_width:]:
+            tree.discard(shv.node_id)
+        self.search_stats["pruned_nodes"] += \
+            max(0, len(children) - self.beam_width)
+        self.search_stats["peak_open_nodes"] = max(
+            self.search_stats["peak_open_nodes"], len(children))
+        return children[:self.beam_width]
+
+    def mcts_search(self, tree, open_list):
+        search = MonteCarloSearch(
+            open_list[0], lambda shv: list(self.neighbour_states(shv)),
+            lambda shv, pt, t: self.mcts_expand(tree, shv, pt, t),
+            lambda shv: self.rollout(tree, shv), self.mcts_exploration,
+            self.mcts_rng)
+        iterations = 0
+        while not self.search_terminator():
+            if self.mcts_iterations and iterations >= self.mcts_iterations:
+                break
+            search.iterate()
+            iterations += 1
+        self.search_stats["mcts_iterations"] += iterations
+        self.search_stats["expanded_nodes"] += iterations
+        tsr = self.make_result(self.get_search_stats())
+        if tsr.path[-1] is open_list[0]:
+            # Nothing covered yet, follow the most visited moves instead
+            tsr.path = search.principal_variation()
+            tsr.path_exec_time = tsr.path[-1].ct
+        return tsr
+
+    def mcts_expand(self, tree, shv, pt, t):
+        nbr_shv = tree.add(self.make_space_heap_value(pt, shv.polys, t), shv)
+        self.incumbent.offer(nbr_shv)
+        return nbr_shv
+
+    def rollout(self, tree, shv):
+        region = self.residuals.materialize(shv.polys)
+        area = shv.priority
+        x, y, t = shv.x, shv.y, shv.ct
+        num_yaws = len(self.rollout_yaws)
+        target = None
+        moves_taken = list()
+        for _ in xrange(self.mcts_rollout_depth):
+            moves = list(self.lattice_moves(x, y, t))
+            if not moves or area <= 0 or region.is_empty:
+                break
+            self.search_stats["rollout_steps"] += 1
+            if self.mcts_rng.random() < self.mcts_rollout_epsilon:
+                moves = [self.mcts_rng.choice(moves)]
+            states = np.empty((len(moves) * num_yaws, 3))
+            states[:, 0] = np.repeat([pt.x for pt, _ in moves], num_yaws)
+            states[:, 1] = np.repeat([pt.y for pt, _ in moves], num_yaws)
+            states[:, 2] = np.tile(self.rollout_yaws, len(moves))
+            footprints = self.get_footprints(states)
+            gains = self.coverage.covered_areas(region, footprints)
+            best = np.argmax(gains)
+            if gains[best] > 0:
+                pt, t = moves[best // num_yaws]
+                region = self.coverage.residual(region, footprints[best])
+                area -= gains[best]
+            else:
+                if target is None:
+                    minx, miny, maxx, maxy = region.bounds
+                    target = (0.5 * (minx + maxx), 0.5 * (miny + maxy))
+                pt, t = min(moves, key=lambda move: math.hypot(
+                    move[0].x - target[0], move[0].y - target[1]))
+            x, y = pt.x, pt.y
+            moves_taken.append((pt, t))
+        if area < self.incumbent.node.priority:
+            self.graft_rollout(tree, shv, moves_taken)
+        total_area = self.incumbent.total_area
+        return 1 - area / total_area if total_area > 0 else 1.0
+
+    def graft_rollout(self, tree, shv, moves):
+        self.search_stats["rollouts_grafted"] += 1
+        parent = shv
+        for pt, t in moves:
+            nbr_shv = self.make_space_heap_value(pt, parent.polys, t)
+            nbr_shv = tree.add(nbr_shv, parent)
+            self.incumbent.offer(nbr_shv)
+            if parent is not shv:
+                tree.release(parent.node_id)
+            parent = nbr_shv
+        if parent is not shv:
+            tree.release(parent.node_id)
+
+    def get_search_root(self, bs_polys):
+        self.residuals.clear()
+        if self.incremental and self.last_bs_polys is not None:
+            self.carry_transpositions(bs_polys)
+        else:
+            self.transpositions.clear()
+        region = self.coverage.make_region(bs_polys)
+        self.last_bs_polys = bs_polys
+        self.coverage_bound = None
+        return self.residuals.root(region)
+
+    def carry_transpositions(self, bs_polys):
+        """
+        Keeps the transposition entries of states whose footprint cannot
+        reach, at any yaw, the blind spots that changed since the last
+        plan. Their yaw and gain still hold on the new root, while their
+        residual is rebuilt from it the next time the entry is used.
+        """
+        change = self.last_bs_polys.symmetric_difference(bs_polys)
+        canonical = self.get_footprint([0, 0, 0])
+        reach = np.hypot(canonical[:, 0], canonical[:, 1]).max() + \
+            self.tt_cell_size
+        near = prep(change.buffer(reach))
+        cells = dict()
+
+        def carry(key, entry):
+            cell = key[0]
+            if cell not in cells:
+                pt = geom.Point(cell[0] * self.tt_cell_size,
+                                cell[1] * self.tt_cell_size)
+                cells[cell] = not near.intersects(pt)
+            if cells[cell]:
+                return entry[0], entry[1], None
+            return None
+
+        self.transpositions.rewrite(carry)
+        self.transpositions.reset_stats()
+        self.search_stats["carried_entries"] = len(self.transpositions)
+
+    def previous_path_seeds(self, pt):
+        if not self.incremental or self.opt_tsr is None:
+            return []
+        next_i = self.next_path_index(self.opt_tsr.path, pt)
+        return self.opt_tsr.path[next_i:]
+
+    def next_path_index(self, shvs, pt):
+        min_dist = None
+        cur_i = 0
+        for i, shv in enumerate(shvs):
+            dist = shv.point.distance(pt)
+            if min_dist is None or dist < min_dist:
+                min_dist = dist
+                cur_i = i
+        return min(cur_i + 1, len(shvs) - 1)
+
+    def seed_path(self, first_value, old_path):
+        seeds = list()
+        if self.poly is None:
+            return seeds
+        prev = first_value
+        for old_shv in old_path:
+            pt = old_shv.point
+            dist = math.hypot(pt.x - prev.x, pt.y - prev.y)
+            nt = prev.ct + dist / self.max_speed
+            if not self.poly.contains(pt) or nt >= self.max_time:
+                break
+            shv = self.make_space_heap_value(pt, prev.polys, nt)
+            seeds.append((shv, prev))
+            prev = shv
+        self.search_stats["seeded_nodes"] += len(seeds)
+        return seeds
+
+    def make_space_heap_value(self, pt, residual, t):
+        key = self.transposition_key(pt, residual)
+        entry = self.cached_evaluation(key, pt, residual)
+        if entry is None:
+            entry = self.evaluate_state(pt, residual)
+            self.transpositions.put(key, entry)
+        yaw, gain, res = entry
+        val = SpaceHeapValue(pt, gain, res, t, yaw)
+        return val
+
+    def evaluate_state(self, pt, residual):
+        polys = self.residuals.materialize(residual)
+        opt_res = self.find_best_yaw(pt, polys)
+        return self.make_evaluation(
+            pt, residual, opt_res.x, -opt_res.fun, opt_res.nfev)
+
+    def make_evaluation(self, pt, residual, yaw, gain, nfev):
+        self.search_stats["yaw_searches"] += 1
+        self.search_stats["objective_evals"] += nfev
+        return yaw, gain, self.make_child(pt, residual, yaw, gain)
+
+    def make_child(self, pt, residual, yaw, gain):
+        footprint = self.get_footprint([pt.x, pt.y, yaw])
+        area = None
+        if self.seen_polygon is None:
+            area = residual.area - gain
+        return self.residuals.child(residual, footprint, area)
+
+    def cached_evaluation(self, key, pt, residual):
+        entry = self.transpositions.get(key)
+        if entry is not None and entry[2] is None:
+            # Carried over from the previous blind spots
+            yaw, gain, _ = entry
+            entry = yaw, gain, self.make_child(pt, residual, yaw, gain)
+            self.transpositions.put(key, entry)
+        return entry
+
+    def closed_prune(self, shv):
+        if not self.use_closed_set:
+            return False
+        cell = self.lattice_cell(shv.x, shv.y)
+        return self.closed.dominated(cell, shv.ct, shv.priority)
+
+    def closed_prune_state(self, shv, pt, t):
+        """
+        Prunes a neighbour before its yaw search when it would be dominated
+        even if its footprint covered a whole footprint area of the parent.
+        """
+        if not self.use_closed_set:
+            return False
+        cell = self.lattice_cell(pt.x, pt.y)
+        return self.closed.dominated(cell, t, shv.priority - self.fp_area)
+
+    def close(self, shv):
+        if self.use_closed_set:
+            cell = self.lattice_cell(shv.x, shv.y)
+            self.closed.add(cell, shv.ct, shv.priority)
+
+    def lattice_cell(self, x, y):
+        return (int(round(x / self.tt_cell_size)),
+                int(round(y / self.tt_cell_size)))
+
+    def transposition_key(self, pt, residual):
+        return self.lattice_cell(pt.x, pt.y), residual.key
+
+    def neighbour_states(self, shv):
+        for nbr_p, nt in self.lattice_moves(shv.x, shv.y, shv.ct):
+            if not self.closed_prune_state(shv, nbr_p, nt) and \
+                    not self.bound_prune_state(shv, nbr_p, nt):
+                yield nbr_p, nt
+
+    def lattice_moves(self, x, y, t):
+        for nbr in self.nbrs:
+            nbr_p = Point(x + nbr[0], y + nbr[1])
+            nt = t + math.hypot(nbr[0], nbr[1]) / self.max_speed
+            if self.corridor is not None and \
+                    not self.corridor.contains(nbr_p):
+                continue
+            if self.poly.contains(nbr_p) and nt < self.max_time:
+                yield nbr_p, nt
+
+    def propogate_neighbours(self, shv):
+        for nbr_p, nt in self.neighbour_states(shv):
+            yield self.make_space_heap_value(nbr_p, shv.polys, nt)
+
+    def propogate_frontier(self, shvs):
+        """
+        Yields (parent, neighbour) pairs for a batch of parents. A parent
+        only counts as expanded once all its neighbours have been yielded,
+        so those dropped at the deadline are not counted.
+        """
+        stats = self.search_stats
+        if self.expander is None:
+            for shv in shvs:
+                for nbr_shv in self.propogate_neighbours(shv):
+                    yield shv, nbr_shv
+                stats["expanded_nodes"] += 1
+            return
+        jobs = list()
+        pending = list()
+        queued = set()
+        repeats = list()
+        waiting = 0
+        for shv in shvs:
+            todo = list()
+            repeated = len(repeats)
+            for nbr_p, nt in self.neighbour_states(shv):
+                key = self.transposition_key(nbr_p, shv.polys)
+                entry = self.cached_evaluation(key, nbr_p, shv.polys)
+                if entry is None and key in queued:
+                    # Same state as another parent's neighbour in this batch
+                    repeats.append((shv, nbr_p, nt))
+                elif entry is None:
+                    queued.add(key)
+                    todo.append((nbr_p, nt, key))
+                else:
+                    yaw, gain, res = entry
+                    yield shv, SpaceHeapValue(nbr_p, gain, res, nt, yaw)
+            if todo:
+                region = self.residuals.materialize(shv.polys)
+                jobs.append((region, [(p.x, p.y) for p, _, _ in todo]))
+                pending.append((shv, todo))
+            if todo or len(repeats) > repeated:
+                waiting += 1
+            else:
+                stats["expanded_nodes"] += 1
+        if not jobs:
+            return
+        optimizer = self.get_yaw_optimizer()
+        remaining = self.search_timeout - self.incumbent.elapsed()
+        all_evals = self.expander.evaluate(optimizer, jobs, remaining)
+        if all_evals is None:
+            return
+        for (shv, todo), evals in zip(pending, all_evals):
+            for (nbr_p, nt, key), (yaw, gain, nfev) in zip(todo, evals):
+                entry = self.make_evaluation(nbr_p, shv.polys, yaw, gain, nfev)
+                self.transpositions.put(key, entry)
+                yield shv, SpaceHeapValue(nbr_p, gain, entry[2], nt, yaw)
+        for shv, nbr_p, nt in repeats:
+            yield shv, self.make_space_heap_value(nbr_p, shv.polys, nt)
+        stats["expanded_nodes"] += waiting
+
+    def search_terminator(self):
+        optimality = self.incumbent.optimality()
+        planner_time = self.incumbent.elapsed()
+        return optimality >= self.perc_opt_thresh or \
+            planner_time >= self.search_timeout or self.search_interrupted()
+
+    def search_interrupted(self):
+        return self.interrupted.is_set() or self.is_shutdown()
+
+    def interrupt(self):
+        self.interrupted.set()
+
+    def get_incumbent(self):
+        return self.make_result()
+
+    def make_result(self, stats=None):
+        shv, path = self.incumbent.get()
+        if shv is None:
+            return None
+        optimality = self.incumbent.optimality(shv)
+        planner_time = self.incumbent.elapsed()
+        return TreeSearchResult(path, optimality, shv.ct, planner_time,
+                                stats)
+
+    def make_search_stats(self):
+        return {"expanded_nodes": 0, "yaw_searches": 0,
+                "objective_evals": 0, "carried_entries": 0, "seeded_nodes": 0,
+                "pruned_nodes": 0, "peak_open_nodes": 0,
+                "bound_pruned": 0, "lattice_levels": 0,
+                "mcts_iterations": 0, "rollout_steps": 0,
+                "rollouts_grafted": 0}
+
+    def get_search_stats(self):
+        stats = dict(self.search_stats)
+        if stats["yaw_searches"] > 0:
+            stats["objective_evals_per_node"] = \
+                float(stats["objective_evals"]) / stats["yaw_searches"]
+        stats.update(self.extrinsics.stats())
+        stats.update(self.residuals.stats())
+        stats.update(self.transpositions.stats())
+        stats.update(self.incumbent.stats())
+        if self.incumbent.tree is not None:
+            stats.update(self.incumbent.tree.stats())
+        stats.update(self.closed.stats())
+        if self.profiler is not None:
+            stats.update(self.profiler.stats())
+        return stats
+
+    def find_best_yaw(self, pt, polys):
+        return self.get_yaw_optimizer().find_best_yaw(pt, polys)
+
+    def get_yaw_optimizer(self):
+        model = self.get_footprint_model()
+        optimizer = self.yaw_optimizer
+        if optimizer is None or optimizer.footprints is not model:
+            optimizer = YawOptimizer(
+                self.coverage, model, self.yaw_search, self.yaw_grid_size,
+                self.yaw_refine_top, self.yaw_max_evals)
+            self.yaw_optimizer = optimizer
+        return optimizer
+
+    def get_camera_extrinsics(self):
+        ext = self.extrinsics.get()
+        if ext is None:
+            return np.eye(3), np.zeros(3)
+        return ext
+
+    def get_footprint_model(self):
+        rot_cq, trans_cq = self.get_camera_extrinsics()
+        key = (self.altitude, self.extrinsics.version)
+        model = self.footprint_model
+        if model is None or model.key != key:
+            if self.use_templates:
+                canonical = self.cam.get_state_projections(
+                    [[0, 0, 0]], self.altitude, rot_cq, trans_cq)[0]
+                model = FootprintTemplate(
+                    canonical, self.template_yaw_res, key)
+            else:
+                model = ProjectedFootprints(
+                    self.cam, self.altitude, rot_cq, trans_cq, key)
+            self.footprint_model = model
+        return model
+
+    def get_footprint(self, state):
+        return self.get_footprint_model().footprint(state)
+
+    def get_footprints(self, states):
+        return self.get_footprint_model().footprints(states)
+
+    def get_projections(self, states):
+        rot_cq, trans_cq = self.get_camera_extrinsics()
+        return self.cam.get_state_projections(states, self.altitude,
+                                              rot_cq, trans_cq)
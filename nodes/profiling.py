@@ -0,0 +1,51 @@
+
+import time
+
+
+class StageProfiler(object):
+    """
+    Wall-clock time and call count per planner stage. A stage is timed by
+    wrapping a method on the instance that owns it, so nothing is added to
+    the hot path unless profiling is on. Timers are inclusive: a stage
+    called from inside another one counts towards both, while a stage
+    re-entered from inside itself is only timed once.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.times = dict()
+        self.calls = dict()
+        self.active = dict()
+
+    def instrument(self, obj, method, stage):
+        func = getattr(obj, method)
+        clock = self.clock
+        times = self.times
+        calls = self.calls
+        active = self.active
+        times.setdefault(stage, 0.0)
+        calls.setdefault(stage, 0)
+        active.setdefault(stage, False)
+
+        def timed(*args, **kwargs):
+            if active[stage]:
+                return func(*args, **kwargs)
+            active[stage] = True
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                times[stage] += clock() - start
+                calls[stage] += 1
+                active[stage] = False
+
+        setattr(obj, method, timed)
+
+    def reset(self):
+        for stage in self.times:
+            self.times[stage] = 0.0
+            self.calls[stage] = 0
+
+    def stats(self):
+        return {"stage_times": dict(self.times),
+                "stage_calls": dict(self.calls)}
@@ -0,0 +1,111 @@
+
+import numpy as np
+from collections import OrderedDict
+
+
+""" Fingerprints are kept modulo this to stay machine-word sized """
+KEY_MODULUS = 2 ** 61 - 1
+
+
+def footprint_key(footprint, tolerance):
+    verts = np.round(np.asarray(footprint) / tolerance).astype(np.int64)
+    return hash(tuple(verts.ravel().tolist())) % KEY_MODULUS
+
+
+class Residual(object):
+    """
+    Blind-spot area still unseen after flying a path, stored as the
+    footprint applied on top of the parent's residual. Only the root keeps
+    its region; the others are materialized on demand by a ResidualStore.
+    `key` fingerprints the set of footprints applied since the root, so
+    residuals reached along different paths can be recognised as equal.
+    """
+
+    __slots__ = ("parent", "footprint", "area", "region", "key")
+
+    def __init__(self, parent, footprint, area, region=None, key=0):
+        self.parent = parent
+        self.footprint = footprint
+        self.area = area
+        self.region = region
+        self.key = key
+
+    def __repr__(self):
+        return "Residual(area={}, ...)".format(self.area)
+
+
+class ResidualStore(object):
+    """
+    Materializes residuals by replaying footprints from the nearest
+    ancestor whose region is known, keeping the `capacity` most recently
+    used regions in an LRU. With `lazy` off every residual is materialized
+    when it is created, as a plain copy per node. A footprint that covers
+    nothing new leaves the parent's residual shared as is.
+    """
+
+    def __init__(self, apply_footprint, capacity=256, lazy=True,
+                 key_tolerance=1e-3):
+        self.apply_footprint = apply_footprint
+        self.key_tolerance = key_tolerance
+        self.capacity = capacity
+        self.lazy = lazy
+        self.lru = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.replays = 0
+
+    def root(self, region):
+        return Residual(None, None, region.area, region)
+
+    def child(self, parent, footprint, area=None):
+        if area is not None and area >= parent.area:
+            return parent
+        key = parent.key + footprint_key(footprint, self.key_tolerance)
+        res = Residual(parent, footprint, area, key=key % KEY_MODULUS)
+        if not self.lazy or area is None:
+            res.region = self.apply_footprint(
+                self.materialize(parent), footprint)
+            res.area = res.region.area
+        return res
+
+    def materialize(self, res):
+        if res.region is not None:
+            return res.region
+        region = self.lru.pop(res, None)
+        if region is not None:
+            self.hits += 1
+            self.lru[res] = region
+            return region
+        self.misses += 1
+        chain = list()
+        node = res
+        while region is None:
+            chain.append(node)
+            node = node.parent
+            region = node.region
+            if region is None:
+                region = self.lru.get(node)
+        for node in reversed(chain):
+            region = self.apply_footprint(region, node.footprint)
+            self.replays += 1
+        self.put(res, region)
+        return region
+
+    def put(self, res, region):
+        self.lru[res] = region
+        while len(self.lru) > self.capacity:
+            self.lru.popitem(last=False)
+
+    def clear(self):
+        self.lru.clear()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.replays = 0
+
+    def stats(self):
+        return {"residual_cache_hits": self.hits,
+                "residual_cache_misses": self.misses,
+                "residual_replays": self.replays}
@@ -4,7 +4,6 @@ import math
 import rospy
 import tf
 import roshelper
-import random
 import time
 
 from geometry_msgs.msg import PoseArray
@@ -18,8 +17,10 @@ from std_msgs.msg import Empty
 from shapely.geometry import Polygon
 #from shapely.geometry import Point
 from point import Point
+from rrt_tree import RRTTree
+from collision import PreparedPolygon
 
-import networkx as nx
+import numpy as np
 
 NODE_NAME = "rrt_planner"
 n = roshelper.Node(NODE_NAME, anonymous=False)
@@ -45,9 +46,18 @@ class RRT_Planner(object):
         self.start_time = 0
         self.waiting_time = 3
 
-        self.graph = nx.Graph()
+        self.tree = None
+        self.tree_polygon = None
+        self.pose_node = None
+        self.incremental = rospy.get_param("~incremental", False)
+        self.goal_tolerance = rospy.get_param("~goal_tolerance", 0.2)
         self.delta_q = 1
-        self.step_size = 0.05
+        self.sample_block = 256
+        self.radius = rospy.get_param("~radius", 1.2)
+        self.max_iterations = rospy.get_param("~max_iterations", 5000)
+        # per plan, kept below the 30 Hz loop period; 0 means no limit
+        self.max_time = rospy.get_param("~max_time", 0.025)
+        self.planner_mode = rospy.get_param("~planner_mode", "rrt_star")
 
         self.odom_msg = None
         self.polygon_msg = None
@@ -68,7 +78,12 @@ class RRT_Planner(object):
 
         if polygon is not None and pose is not None \
                 and setpoint is not None:
-            if self.path is not None:
+            if self.incremental:
+                self.path = self.replan(polygon,pose,setpoint)
+                if len(self.path) == 0:
+                    self.path = None
+                    return
+            elif self.path is not None:
                 # print "removing and adding pose/setpoint"
                 # print len(self.path)
                 self.path.pop(0)
@@ -81,13 +96,19 @@ class RRT_Planner(object):
                         self.path.pop(0)
                         if len(self.path) > 1:
                             # print "repairing path"
-                            self.path = self.repair2(self.path,polygon,self.step_size, self.delta_q)
+                            self.path = self.repair2(self.path,polygon)
                 else:
                     self.path = None
             if self.path is None:
                 # print "starting path afresh"
-                self.graph = self.make_rrt(polygon,pose,setpoint,self.step_size,self.delta_q,200)
-                self.path = self.path_from_graph(self.graph,pose,setpoint)
+                if self.planner_mode == "rrt_connect":
+                    self.path = self.make_rrt_connect(polygon,pose,setpoint,self.delta_q,self.max_iterations)
+                else:
+                    self.tree, connection = self.make_rrt(polygon,pose,setpoint,self.delta_q,self.max_iterations)
+                    self.path = self.path_from_tree(self.tree, connection, setpoint)
+                if len(self.path) == 0:
+                    self.path = None
+                    return
 
             path = Path()
             path.header.frame_id = self.fixed_frame_id
@@ -125,160 +146,215 @@ class RRT_Planner(object):
         else:
             return path.poses[0]
 
-    def path_from_graph(self,graph,start,end):
-        try:
-            path = nx.shortest_path(self.graph, source=start,target=end)
-        except nx.NetworkXError:
-            rospy.logerr("Error converting graph into path")
-            path = []
+    # path from the root through the connection node to the target
+    def path_from_tree(self,tree,connection,target):
+        if connection is None:
+            rospy.logerr("No path to the setpoint in the tree")
+            return []
+        return [Point(*tree.coords[i]) for i in tree.path(connection)] + [target]
+
+    def repair2(self,path,polygon):
+        coords = [(point.x, point.y) for point in path]
+        if not polygon.points_inside(coords).all():
+            return None
+        if not polygon.segments_free(coords[:-1], coords[1:]).all():
+            return None
         return path
 
-    def repair2(self,path,polygon,step_size,delta_q):
-        for each_point in path:
-            point = Point(each_point)
-            if polygon.contains(point) is False:
-                return None
-        i = 0
-        while i < len(path)-1:
-            start = Point(path[i])
-            end = Point(path[i+1])
-            if self.is_there_collision(polygon,end,start,step_size,start.distance(end)):
-                return None
-            i = i + 1
+    def make_rrt(self, polygon, start, target, delta_q, max_k):
+        tree = RRTTree(start.x, start.y, self.radius)
+        return tree, self.grow_rrt(polygon, tree, target, delta_q, max_k)
+
+    # incremental mode: the tree is rooted at the setpoint and kept across
+    # polygon updates. A new polygon only cuts the edges that now collide,
+    # and the pose is reconnected to what is left.
+    def replan(self, polygon, pose, setpoint):
+        tree = self.tree
+        if tree is None or not polygon.contains(tree.coords[0]) or \
+                setpoint.distance(Point(*tree.coords[0])) > self.goal_tolerance:
+            tree = self.tree = RRTTree(setpoint.x, setpoint.y, self.radius)
+            self.pose_node = None
+        elif polygon is not self.tree_polygon:
+            remap = self.prune_tree(tree, polygon)
+            if remap is not None and self.pose_node is not None:
+                self.pose_node = remap[self.pose_node]
+                if self.pose_node < 0:
+                    self.pose_node = None
+        self.tree_polygon = polygon
+        connection = self.grow_rrt(polygon, tree, pose, self.delta_q, self.max_iterations, refine=False)
+        if connection is not None:
+            distance = tree.distances([connection], pose.x, pose.y)[0]
+            if distance >= self.radius:
+                self.keep_pose(tree, pose, connection, tree.costs[connection] + distance)
+        path = self.path_from_tree(tree, connection, pose)
+        path.reverse()
+        # skip waypoints already reached, as the default mode does
+        while len(path) > 2 and path[0].distance(path[1]) < 0.2:
+            path.pop(1)
         return path
 
-    def repair(self,path,polygon,step_size,delta_q):
-        def repair_nodes(start, index):
-            # print "repair nodes"
-            if index > len(path) - 1:
-                return [index, None]
-            end = Point(path[index])
-            # print "does polygon contain x: %f y: %f  ?" % (end.x, end.y)
-            if polygon.contains(end):
-                # print "yes"
-                if self.is_there_collision(polygon, end, start, step_size, start.distance(end)):
-                    # print "IT HAPPENED"
-                    # need to repair link between start and next points
-                    graph = self.make_rrt(polygon,start,end,step_size,delta_q/4.0,100)
-                    # print "RRT DONE"
-                    new_path = self.path_from_graph(graph,start,end)
-                    if len(new_path) == 0:
-                        return repair_nodes(start, index+1)
-                    else:
-                        return [index, new_path]
-                else:
-                    #print "no collisions they say between x1: %f y1: %f and x2: %f and y2: %f" % (start.x,start.y,end.x,end.y)
-                    new_path = [start, end]
-                    return [index, []]
-            else:
-                # print "no"
-                return repair_nodes(start, index+1)
-
-        repaired_path = path
-
-        i = 1
-        while i < len(path):
-            # print "start is %d" % i
-            start_point = Point(path[i])
-
-            [i, new_path] = repair_nodes(start_point,i)
-            if new_path is None:
-                # print "none"
-                return None
-            else:
-                #[i, new_path] = repair_info
-                # print new_path
-                if len(new_path) > 0:
-                    new_path.pop(0)
-                    new_path.pop()
-                    start_index = repaired_path.index(start_point) + 1
-                    for new_point in new_path:
-                        repaired_path.insert(start_index, new_point)
-                        start_index = start_index + 1
-
-            i = i + 1
-
-        return repaired_path
-
-    def make_rrt(self, polygon, start, target, step_size, delta_q, max_k):
+    # keeps the pose so the next cycles find it as a neighbour. The pose
+    # node of an earlier cycle is moved rather than a new one added while
+    # nothing hangs off it, so hovering does not grow the tree.
+    def keep_pose(self, tree, pose, parent, cost):
+        i = self.pose_node
+        if i is not None and i != parent and tree.is_leaf(i):
+            tree.move(i, pose.x, pose.y, parent, cost)
+        else:
+            self.pose_node = tree.add(pose.x, pose.y, parent, cost)
+
+    # nodes whose edge to their parent now collides are moved under the
+    # cheapest surviving neighbour they can reach, upstream nodes first.
+    # The subtrees of those that cannot be reattached are dropped, and the
+    # renumbering from RRTTree.remove is returned, or None if none were.
+    def prune_tree(self, tree, polygon):
+        children = np.arange(1, len(tree))
+        free = polygon.segments_free(tree.coords[children], tree.coords[tree.parents[children]])
+        blocked = np.zeros(len(tree), dtype=bool)
+        blocked[children[~free]] = True
+        cut = np.flatnonzero(blocked)
+        for i in cut[np.argsort(tree.costs[cut])]:
+            x, y = tree.coords[i]
+            if not polygon.contains((x, y)):
+                continue
+            neighbours = tree.near(x, y, self.radius)
+            neighbours = neighbours[~tree.descendants(blocked)[neighbours]]
+            if len(neighbours) == 0:
+                continue
+            parent = self.choose_parent(neighbours[0], x, y, tree, neighbours, polygon)
+            if parent is not None:
+                distance = tree.distances([parent], x, y)[0]
+                tree.set_parent(i, parent, tree.costs[parent] + distance)
+                blocked[i] = False
+        if blocked.any():
+            return tree.remove(tree.descendants(blocked))
+        return None
+
+    # grows the tree towards target and returns the node the target
+    # connects to most cheaply, or None if the budget ran out first. Every
+    # sample counts towards max_k, so a start the tree cannot leave still
+    # returns. With refine the tree keeps growing for a while after the
+    # first connection.
+    def grow_rrt(self, polygon, tree, target, delta_q, max_k, refine=True):
         k = 0
-        graph = nx.DiGraph()
-        graph.add_node(start, cost=0)
-        unfinished = True
-        if self.attempt_to_complete(polygon,start,target,step_size):
-            distance = start.distance(target)
-            graph.add_node(target, cost=distance)
-            graph.add_edge(start,target, weight = distance)
-            unfinished = False
-
-        while k < max_k and unfinished:
-
-
-            (minx, miny, maxx, maxy) = polygon.bounds
-
-            rand_x = random.uniform(minx, maxx)
-            rand_y = random.uniform(miny, maxy)
-
-            q_rand = Point(rand_x, rand_y)
-
-            q_near = self.find_nearest(q_rand, graph)
-            q_new = self.new_conf(q_near, q_rand, delta_q)
-            q_near = self.choose_parent(q_near, q_new, graph)
-
-            if polygon.contains(q_new):
-                if self.is_there_collision(polygon, q_new, q_near, step_size, delta_q) is False:
-                    #print "adding point x: %f y: %f" % (q_new.x, q_new.y)
-                    distance = q_near.distance(q_new)
-                    prev_cost = graph.node[q_near]['cost']
-                    new_cost = prev_cost + distance
-                    graph.add_node(q_new, cost=new_cost)
-                    graph.add_edge(q_near, q_new, weight=distance)
-
-                    graph = self.rewire(graph,q_new, polygon, step_size)
-
-                    if self.attempt_to_complete(polygon, q_new, target, step_size):
-                        distance = q_new.distance(target)
-                        prev_cost = graph.node[q_near]['cost']
-                        new_cost = prev_cost + distance
-                        graph.add_node(target, cost = new_cost)
-                        graph.add_edge(q_new, target, weight = distance)
-                        unfinished = True
+        start_time = time.time()
+        iterations = 0
+        neighbours = tree.near(target.x, target.y, self.radius)
+        connection = self.choose_parent(0, target.x, target.y, tree, neighbours, polygon)
+        connections = []
+        unfinished = connection is None
+
+        samples = self.samples(polygon.bounds)
+        while k < max_k and unfinished and not self.out_of_time(start_time):
+
+            rand_x, rand_y = next(samples)
+            iterations += 1
+
+            near = tree.nearest(rand_x, rand_y)
+            new_x, new_y = self.steer(tree.coords[near], rand_x, rand_y, delta_q)
+
+            if polygon.contains((new_x, new_y)):
+                neighbours = tree.near(new_x, new_y, self.radius)
+                near = self.choose_parent(near, new_x, new_y, tree, neighbours, polygon)
+                if near is not None:
+                    #print "adding point x: %f y: %f" % (new_x, new_y)
+                    distance = tree.distances([near], new_x, new_y)[0]
+                    new = tree.add(new_x, new_y, near, tree.costs[near] + distance)
+
+                    self.rewire(tree, new, neighbours, polygon)
+
+                    if self.attempt_to_complete(polygon, (new_x, new_y), target):
+                        if not connections:
+                            rospy.logdebug("RRT* first path after %d iterations in %.3f s", iterations, time.time() - start_time)
+                        connections.append(new)
+                        unfinished = refine
                         k = k + k/2.0
-                    k = k + 1
 
             #else:
-                #print "point x: %f y: %f was not in polygon" % (q_new.x, q_new.y)
-
-        return graph
-
-    def rewire(self,graph,q_new, polygon,step_size):
-        for p in graph.nodes():
-            RADIUS = 1.2
-            q_parents = graph.predecessors(q_new)
-            if p not in q_parents and p.distance(q_new) < RADIUS and graph.node[q_new]['cost']+p.distance(q_new) < graph.node[p]['cost']:
-                if self.is_there_collision(polygon, q_new, p, step_size, p.distance(q_new)) is False:
-                    p_parent = graph.predecessors(p)[0]
-                    #if len(p_parents) > 0:
-                    #p_parent = p_parents[0]
-                    graph.remove_edge(p_parent,p)
-                    graph.add_edge(q_new,p,weight = p.distance(q_new))
-                    graph.node[p]['cost'] = graph.node[q_new]['cost']+p.distance(q_new)
-        return graph
-
-    def attempt_to_complete(self, polygon, q_new, setpoint, step_size):
-        if self.is_there_collision(polygon, setpoint, q_new, step_size, q_new.distance(setpoint)) is False:
-            return True
-        return False
-
-    # return TRUE if there is a collision
-    def is_there_collision(self, polygon, q_new, q_near, step_size, delta_q):
-        step = step_size
-        while step <= delta_q:
-            q_check = self.new_conf(q_near, q_new,step)
-            if polygon.contains(q_check) is False:
-                return True
-            step = step + step_size
-        return False
+                #print "point x: %f y: %f was not in polygon" % (new_x, new_y)
+            k = k + 1
+
+        if connections:
+            # rewiring may have changed costs since each was found
+            connections = np.array(connections)
+            costs = tree.costs[connections] + tree.distances(connections, target.x, target.y)
+            connection = connections[np.argmin(costs)]
+        return connection
+
+    # bidirectional mode: one tree grows from start and one from target.
+    # Each iteration extends one of them towards a sample and then greedily
+    # extends the other towards the new node, swapping their roles. As in
+    # grow_rrt, every iteration counts towards max_k, blocked ones too.
+    def make_rrt_connect(self, polygon, start, target, delta_q, max_k):
+        if polygon.segment_free(start, target):
+            return [start, target]
+        start_time = time.time()
+        start_tree = RRTTree(start.x, start.y, self.radius)
+        tree, other = start_tree, RRTTree(target.x, target.y, self.radius)
+        samples = self.samples(polygon.bounds)
+        k = 0
+        while k < max_k and not self.out_of_time(start_time):
+            rand_x, rand_y = next(samples)
+            k = k + 1
+            tree, other = other, tree
+            new = self.extend(tree, rand_x, rand_y, polygon, delta_q)
+            if new is None:
+                continue
+            new_x, new_y = tree.coords[new]
+            reached = self.connect(other, new_x, new_y, polygon, delta_q)
+            if reached is not None:
+                rospy.logdebug("RRT-Connect path after %d iterations in %.3f s", k, time.time() - start_time)
+                path = [Point(*tree.coords[i]) for i in tree.path(new)] + \
+                    [Point(*other.coords[i]) for i in reversed(other.path(reached))]
+                if tree is not start_tree:
+                    path.reverse()
+                return path
+        rospy.logerr("RRT-Connect found no path in %d iterations", k)
+        return []
+
+    # one step of at most delta_q from the nearest node towards (x, y)
+    def extend(self, tree, x, y, polygon, delta_q):
+        near = tree.nearest(x, y)
+        new_x, new_y = self.steer(tree.coords[near], x, y, delta_q)
+        if not polygon.segment_free(tree.coords[near], (new_x, new_y)):
+            return None
+        distance = tree.distances([near], new_x, new_y)[0]
+        return tree.add(new_x, new_y, near, tree.costs[near] + distance)
+
+    # steps from the nearest node towards (x, y) until a free straight
+    # edge to it remains, returning that node, or None if blocked first
+    def connect(self, tree, x, y, polygon, delta_q):
+        near = tree.nearest(x, y)
+        while True:
+            step_x, step_y = self.steer(tree.coords[near], x, y, delta_q)
+            free = polygon.segments_free(tree.coords[near], ((x, y), (step_x, step_y)))
+            if free[0]:
+                return near
+            if not free[1]:
+                return None
+            distance = tree.distances([near], step_x, step_y)[0]
+            near = tree.add(step_x, step_y, near, tree.costs[near] + distance)
+
+    def out_of_time(self, start_time):
+        return self.max_time > 0 and time.time() - start_time > self.max_time
+
+    # neighbours are the tree nodes within self.radius of the new node
+    def rewire(self, tree, new, neighbours, polygon):
+        x, y = tree.coords[new]
+        costs = tree.costs[new] + tree.distances(neighbours, x, y)
+        cheaper = (costs < tree.costs[neighbours]) & (neighbours != tree.parents[new])
+        if not cheaper.any():
+            return
+        neighbours = neighbours[cheaper]
+        costs = costs[cheaper]
+        free = polygon.segments_free(tree.coords[neighbours], (x, y))
+        for p, cost in zip(neighbours[free], costs[free]):
+            # an earlier rewire may already have lowered the cost of p
+            if cost < tree.costs[p]:
+                tree.set_parent(p, new, cost)
+
+    def attempt_to_complete(self, polygon, q_new, setpoint):
+        return polygon.segment_free(q_new, setpoint)
 
     def new_conf(self, q_near, q_rand, delta_q):
         if q_rand.distance(q_near) < delta_q:
@@ -291,22 +367,31 @@ class RRT_Planner(object):
             new_y = q_near.y + delta_q*(diff_y/dist)
             return Point(new_x,new_y)
 
-    def find_nearest(self, q_rand, graph):
-        q_near = None
-        for point in graph.nodes():
-            if q_near is None:
-                q_near = point
-            elif q_rand.distance(point) < q_rand.distance(q_near):
-                q_near = point
-        return q_near
-
-
-    def choose_parent(self, q_near,q_new,graph):
-        RADIUS = 1.2
-        for p in graph.nodes():
-            if p.distance(q_new) < RADIUS and graph.node[p]['cost']+p.distance(q_new) < graph.node[q_near]['cost']+q_near.distance(q_new):
-                q_near = p
-        return q_near
+    def steer(self, q_near, rand_x, rand_y, delta_q):
+        near_x, near_y = q_near
+        dist = math.hypot(rand_x - near_x, rand_y - near_y)
+        if dist < delta_q:
+            return rand_x, rand_y
+        return (near_x + delta_q*(rand_x - near_x)/dist,
+                near_y + delta_q*(rand_y - near_y)/dist)
+
+    # uniform samples over the polygon bounds, drawn in blocks
+    def samples(self, bounds):
+        (minx, miny, maxx, maxy) = bounds
+        while True:
+            block = np.random.uniform((minx, miny), (maxx, maxy), (self.sample_block, 2))
+            for x, y in block.tolist():
+                yield x, y
+
+    # cheapest of the neighbours and near with a free edge to the new
+    # node, or None if every edge collides
+    def choose_parent(self, near, new_x, new_y, tree, neighbours, polygon):
+        candidates = np.append(neighbours, near)
+        costs = tree.costs[candidates] + tree.distances(candidates, new_x, new_y)
+        free = polygon.segments_free(tree.coords[candidates], (new_x, new_y))
+        if not free.any():
+            return None
+        return candidates[free][np.argmin(costs[free])]
 
     @n.subscriber(POLYGON_TOPIC, PolygonStamped)
     def polygon_sub(self, poly):
@@ -317,7 +402,7 @@ class RRT_Planner(object):
             x = point.x
             y = point.y
             points.append([x,y])
-        self.polygon = Polygon(points)
+        self.polygon = PreparedPolygon(Polygon(points))
 
     @n.subscriber(SETPOINT_TOPIC, PoseStamped)
     def setpoint_sub(self, ps):
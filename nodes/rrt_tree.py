@@ -0,0 +1,119 @@
+
+import numpy as np
+from spatial import GridIndex
+
+
+class RRTTree(object):
+    """
+    RRT tree kept in preallocated arrays of node coordinates, parent
+    indices and path costs, grown `chunk` nodes at a time. Node 0 is the
+    root and has parent -1. Nodes are also hashed into a GridIndex with
+    `cell_size` metre cells for nearest and radius queries.
+    """
+
+    def __init__(self, x, y, cell_size, chunk=256):
+        self.chunk = chunk
+        self.coords = np.empty((chunk, 2))
+        self.parents = np.empty(chunk, dtype=int)
+        self.costs = np.empty(chunk)
+        self.size = 0
+        self.index = GridIndex(cell_size)
+        self.add(x, y, -1, 0.0)
+
+    def __len__(self):
+        return self.size
+
+    def grow(self):
+        capacity = len(self.costs) + self.chunk
+        self.coords = np.resize(self.coords, (capacity, 2))
+        self.parents = np.resize(self.parents, capacity)
+        self.costs = np.resize(self.costs, capacity)
+
+    def add(self, x, y, parent, cost):
+        if self.size == len(self.costs):
+            self.grow()
+        i = self.size
+        self.coords[i] = x, y
+        self.parents[i] = parent
+        self.costs[i] = cost
+        self.index.insert(i, x, y)
+        self.size += 1
+        return i
+
+    def nearest(self, x, y):
+        i = self.index.nearest_local(x, y)
+        if i is None:
+            diffs = self.coords[:self.size] - (x, y)
+            i = int(np.argmin(diffs[:, 0] ** 2 + diffs[:, 1] ** 2))
+        return i
+
+    def near(self, x, y, radius):
+        return np.array(self.index.within(x, y, radius), dtype=int)
+
+    def distances(self, idxs, x, y):
+        diffs = self.coords[idxs] - (x, y)
+        return np.hypot(diffs[:, 0], diffs[:, 1])
+
+    def descendants(self, mask):
+        """ Extends a mask over nodes to the subtrees rooted at them """
+        parents = self.parents[:self.size]
+        mask = np.append(mask, False)
+        count = mask.sum()
+        while True:
+            # parents of -1 land on the always-False guard entry
+            mask[:-1] |= mask[parents]
+            new_count = mask.sum()
+            if new_count == count:
+                return mask[:-1]
+            count = new_count
+
+    def subtree(self, i):
+        """ Mask over the nodes of the subtree rooted at node i """
+        mask = np.zeros(self.size, dtype=bool)
+        mask[i] = True
+        return self.descendants(mask)
+
+    def set_parent(self, i, parent, cost):
+        """ Reattaches node i under `parent`, updating its subtree's costs """
+        delta = cost - self.costs[i]
+        self.parents[i] = parent
+        self.costs[:self.size][self.subtree(i)] += delta
+
+    def remove(self, mask):
+        """
+        Drops the masked nodes, which must be closed under descendants and
+        exclude the root. The survivors are packed to the front of the
+        arrays and renumbered in order. Returns the new index of every old
+        node, -1 for the dropped ones.
+        """
+        keep = ~mask
+        remap = np.where(keep, np.cumsum(keep) - 1, -1)
+        size = int(keep.sum())
+        parents = self.parents[:self.size][keep]
+        self.parents[:size] = np.where(parents >= 0, remap[parents], -1)
+        self.coords[:size] = self.coords[:self.size][keep]
+        self.costs[:size] = self.costs[:self.size][keep]
+        self.size = size
+        self.index.clear()
+        for i, (x, y) in enumerate(self.coords[:size].tolist()):
+            self.index.insert(i, x, y)
+        return remap
+
+    def is_leaf(self, i):
+        return not (self.parents[:self.size] == i).any()
+
+    def move(self, i, x, y, parent, cost):
+        """ Moves leaf node i to (x, y) under `parent` """
+        self.coords[i] = x, y
+        self.parents[i] = parent
+        self.costs[i] = cost
+        self.index.insert(i, x, y)
+
+    def path(self, i):
+        """ Node indices from the root to node i """
+        path = list()
+        while i >= 0:
+            path.append(i)
+            i = self.parents[i]
+        path.reverse()
+        return path
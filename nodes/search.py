@@ -1,12 +1,35 @@
 
+import array
+import threading
+import time
+from collections import OrderedDict
+from point import Point
+
+
 class SpaceHeapValue(object):
+    """
+    Search node. The priority is the residual area, cached when the node
+    is created, `node_id` indexes the node in its SearchTree and `depth` is
+    the number of edges from the root of the search.
+    """
+
+    __slots__ = ("x", "y", "area", "polys", "ct", "yaw", "priority",
+                 "node_id", "depth")
 
     def __init__(self, point, area, polygons, current_time, yaw):
-        self.point = point
+        self.x = point[0]
+        self.y = point[1]
         self.area = area
         self.polys = polygons
         self.ct = current_time
         self.yaw = yaw
+        self.priority = polygons.area
+        self.node_id = -1
+        self.depth = 0
+
+    @property
+    def point(self):
+        return Point(self.x, self.y)
 
     def __repr__(self):
         return "SpaceHeapValue(area={}, ...)".format(self.area)
@@ -14,29 +37,275 @@ class SpaceHeapValue(object):
     def __str__(self):
         return repr(self)
 
-    def __cmp__(self, other):
-        return cmp(self.polys.area, other.polys.area)
+    def __lt__(self, other):
+        return self.priority < other.priority
+
+
+class SearchTree(object):
+    """
+    Array-backed store of the nodes created by a search. A node's id is
+    its index in `nodes`, and `parents` holds the id of its parent or -1.
+    `refs` counts the holds on each node: one for its creator, such as
+    the open list, one per child and one while it is the incumbent. Once
+    the last hold is released the node is freed and its id reused, so the
+    tree only grows with the open nodes and the paths leading to them,
+    not with every node the search has generated.
+    """
+
+    def __init__(self):
+        self.nodes = list()
+        self.parents = array.array("l")
+        self.refs = array.array("l")
+        self.free = list()
+        self.peak = 0
+
+    def __len__(self):
+        return len(self.nodes) - len(self.free)
+
+    def add(self, node, parent=None):
+        parent_id = -1
+        node.depth = 0
+        if parent is not None:
+            parent_id = parent.node_id
+            node.depth = parent.depth + 1
+            self.refs[parent_id] += 1
+        if self.free:
+            node_id = self.free.pop()
+            self.nodes[node_id] = node
+            self.parents[node_id] = parent_id
+            self.refs[node_id] = 1
+        else:
+            node_id = len(self.nodes)
+            self.nodes.append(node)
+            self.parents.append(parent_id)
+            self.refs.append(1)
+            self.peak = max(self.peak, len(self.nodes))
+        node.node_id = node_id
+        return node
+
+    def heap_item(self, node):
+        return node.priority, node.node_id
+
+    def get(self, heap_item):
+        return self.nodes[heap_item[1]]
+
+    def retain(self, node_id):
+        self.refs[node_id] += 1
 
-    def __hash__(self):
-        return hash("{} {}".format(str(self.point), self.ct))
+    def release(self, node_id):
+        """ Drops a hold, freeing the node and any ancestors left unheld """
+        while node_id >= 0:
+            self.refs[node_id] -= 1
+            if self.refs[node_id] > 0:
+                return
+            self.nodes[node_id] = None
+            self.free.append(node_id)
+            node_id = self.parents[node_id]
 
-    def __eq__(self, other):
-        return hash(self) == hash(other)
+    def discard(self, node_id):
+        self.release(node_id)
+
+    def path(self, node):
+        path = [None] * (node.depth + 1)
+        node_id = node.node_id
+        for i in xrange(node.depth, -1, -1):
+            path[i] = self.nodes[node_id]
+            node_id = self.parents[node_id]
+        return path
+
+    def stats(self):
+        return {"tree_nodes": len(self), "peak_tree_nodes": self.peak}
 
 
 class TreeSearchResult(object):
 
-    def __init__(self, path, optimality, path_exec_time, planner_time):
+    def __init__(self, path, optimality, path_exec_time, planner_time,
+                 stats=None):
         self.path = path
         self.optimality = optimality
         self.path_exec_time = path_exec_time
         self.planner_time = planner_time
+        self.stats = stats if stats is not None else dict()
 
     def __str__(self):
         tsr_str = """TreeSearchResult:
         optimality: {},
         path_exec_time: {},
-        planner_time: {}
+        planner_time: {},
+        stats: {}
         """
         return tsr_str.format(
-            self.optimality, self.path_exec_time, self.planner_time)
+            self.optimality, self.path_exec_time, self.planner_time,
+            self.stats)
+
+
+class Incumbent(object):
+    """
+    Best node found so far by a running search. Improvements are taken
+    under a lock so another thread can read a usable plan at any time,
+    and each one is appended to `curve` as (planner time, optimality).
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.start(None, 0.0, clock())
+
+    def start(self, tree, total_area, start_time):
+        with self.lock:
+            self.tree = tree
+            self.total_area = total_area
+            self.start_time = start_time
+            self.node = None
+            self.curve = list()
+
+    def restart(self, tree):
+        with self.lock:
+            self.tree = tree
+            self.node = None
+
+    def offer(self, node):
+        if self.node is not None and node.priority >= self.node.priority:
+            return False
+        with self.lock:
+            if self.tree is not None:
+                self.tree.retain(node.node_id)
+                if self.node is not None:
+                    self.tree.release(self.node.node_id)
+            self.node = node
+            self.curve.append((self.elapsed(), self.optimality(node)))
+        return True
+
+    def get(self):
+        """
+        The best node and its path. The path is read under the lock, as
+        the search frees and reuses the ids of nodes it no longer holds.
+        """
+        with self.lock:
+            if self.node is None:
+                return None, None
+            return self.node, self.tree.path(self.node)
+
+    def elapsed(self):
+        return self.clock() - self.start_time
+
+    def optimality(self, node=None):
+        node = node if node is not None else self.node
+        if node is None:
+            return 0.0
+        if self.total_area <= 0:
+            return 1.0
+        return 1 - node.priority / self.total_area
+
+    def stats(self):
+        with self.lock:
+            curve = list(self.curve)
+        return {"incumbent_updates": len(curve),
+                "incumbent_curve": curve}
+
+
+class ClosedSet(object):
+    """
+    Arrival time and residual area of the states expanded in each lattice
+    cell, kept as a front of mutually non-dominated pairs. A state is
+    dominated when a state already expanded in its cell arrived no later
+    and left no more area unseen.
+    """
+
+    def __init__(self, tolerance=1e-9):
+        self.tolerance = tolerance
+        self.cells = dict()
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self.cells)
+
+    def dominated(self, cell, t, area):
+        tol = self.tolerance
+        for ct, res_area in self.cells.get(cell, ()):
+            if ct <= t + tol and res_area <= area + tol:
+                self.rejected += 1
+                return True
+        return False
+
+    def add(self, cell, t, area):
+        tol = self.tolerance
+        front = [(ct, res_area) for ct, res_area in self.cells.get(cell, ())
+                 if ct < t - tol or res_area < area - tol]
+        front.append((t, area))
+        self.cells[cell] = front
+
+    def clear(self):
+        self.cells.clear()
+        self.rejected = 0
+
+    def stats(self):
+        return {"closed_cells": len(self.cells),
+                "closed_rejected": self.rejected}
+
+
+class TranspositionTable(object):
+    """
+    Bounded LRU map from a search state key to the evaluation of that
+    state, so states reached again through another parent are not
+    re-evaluated. A capacity of zero disables the table.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.table = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.table)
+
+    def get(self, key):
+        if self.capacity <= 0:
+            return None
+        entry = self.table.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.table[key] = entry
+        return entry
+
+    def put(self, key, entry):
+        if self.capacity <= 0:
+            return
+        self.table[key] = entry
+        while len(self.table) > self.capacity:
+            self.table.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.table.clear()
+        self.reset_stats()
+
+    def rewrite(self, update):
+        """
+        Replaces every entry by update(key, entry), dropping those it
+        maps to None, in LRU order.
+        """
+        for key, entry in self.table.items():
+            entry = update(key, entry)
+            if entry is None:
+                del self.table[key]
+            else:
+                self.table[key] = entry
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = float(self.hits) / lookups if lookups > 0 else 0.0
+        return {"tt_hits": self.hits,
+                "tt_misses": self.misses,
+                "tt_evictions": self.evictions,
+                "tt_size": len(self.table),
+                "tt_hit_rate": hit_rate}
@@ -0,0 +1,131 @@
+
+import math
+
+
+class GridIndex(object):
+    """
+    Spatial hash of 2D points on square cells of `cell_size` metres.
+    Nearest-neighbour and radius queries only visit the cells around the
+    query point, so their cost depends on the local density of points
+    rather than their count. Points can be inserted and removed at any
+    time, so the index grows with the tree without rebuilds. Buckets hold
+    (key, x, y) entries so queries never hash the keys.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = float(cell_size)
+        self.cells = dict()
+        self.positions = dict()
+        self.extent = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def cell(self, x, y):
+        return (int(math.floor(x / self.cell_size)),
+                int(math.floor(y / self.cell_size)))
+
+    def insert(self, key, x, y):
+        if key in self.positions:
+            self.remove(key)
+        self.positions[key] = (x, y)
+        i, j = self.cell(x, y)
+        self.cells.setdefault((i, j), list()).append((key, x, y))
+        if self.extent is None:
+            self.extent = [i, j, i, j]
+        else:
+            extent = self.extent
+            extent[0] = min(extent[0], i)
+            extent[1] = min(extent[1], j)
+            extent[2] = max(extent[2], i)
+            extent[3] = max(extent[3], j)
+
+    def remove(self, key):
+        x, y = self.positions.pop(key)
+        cell = self.cell(x, y)
+        bucket = self.cells[cell]
+        bucket.remove((key, x, y))
+        if not bucket:
+            del self.cells[cell]
+
+    def clear(self):
+        self.cells.clear()
+        self.positions.clear()
+        self.extent = None
+
+    def within(self, x, y, radius):
+        """ Keys of the points strictly closer than `radius` to (x, y) """
+        i0, j0 = self.cell(x - radius, y - radius)
+        i1, j1 = self.cell(x + radius, y + radius)
+        r2 = radius * radius
+        found = list()
+        for i in xrange(i0, i1 + 1):
+            for j in xrange(j0, j1 + 1):
+                for key, px, py in self.cells.get((i, j), ()):
+                    if (px - x) ** 2 + (py - y) ** 2 < r2:
+                        found.append(key)
+        return found
+
+    def nearest(self, x, y):
+        """ Key of the point closest to (x, y), or None if it is empty """
+        key = self.nearest_local(x, y)
+        if key is None:
+            key = self.nearest_linear(x, y)
+        return key
+
+    def nearest_local(self, x, y):
+        """
+        Cells are scanned in growing square rings around the query cell
+        until the ring is further away than the best point found so far.
+        Once the rings cover more cells than there are points, as for a
+        query far from a small tree, this gives up and returns None so the
+        caller can scan the points directly instead.
+        """
+        if not self.positions:
+            return None
+        ci, cj = self.cell(x, y)
+        i_min, j_min, i_max, j_max = self.extent
+        max_ring = max(ci - i_min, i_max - ci, cj - j_min, j_max - cj, 0)
+        best = None
+        best_d2 = float("inf")
+        ring = 0
+        while ring <= max_ring:
+            if (2 * ring + 1) ** 2 > len(self.positions):
+                return None
+            for cell in self.ring_cells(ci, cj, ring):
+                for key, px, py in self.cells.get(cell, ()):
+                    d2 = (px - x) ** 2 + (py - y) ** 2
+                    if d2 < best_d2:
+                        best = key
+                        best_d2 = d2
+            # Points in the next ring are at least `ring` cells away
+            reach = ring * self.cell_size
+            if best is not None and best_d2 <= reach * reach:
+                break
+            ring += 1
+        return best
+
+    def nearest_linear(self, x, y):
+        best = None
+        best_d2 = float("inf")
+        for bucket in self.cells.itervalues():
+            for key, px, py in bucket:
+                d2 = (px - x) ** 2 + (py - y) ** 2
+                if d2 < best_d2:
+                    best = key
+                    best_d2 = d2
+        return best
+
+    def ring_cells(self, ci, cj, ring):
+        if ring == 0:
+            yield (ci, cj)
+            return
+        for i in xrange(ci - ring, ci + ring + 1):
+            yield (i, cj - ring)
+            yield (i, cj + ring)
+        for j in xrange(cj - ring + 1, cj + ring):
+            yield (ci - ring, j)
+            yield (ci + ring, j)
@@ -0,0 +1,76 @@
+
+import math
+import numpy as np
+import scipy.optimize as opt
+
+
+class YawOptimizer(object):
+    """
+    Finds the yaw whose footprint covers the most of a residual region.
+    `footprints` is a footprint model such as a FootprintTemplate and
+    `coverage` a coverage backend. In "bounded" mode the yaw is found with
+    a bounded scalar search; in "grid" mode a grid of yaws is scored in
+    one batch and the best few are refined. At most `max_evals` objective
+    evaluations are spent per call.
+    """
+
+    def __init__(self, coverage, footprints, mode="bounded", grid_size=16,
+                 refine_top=2, max_evals=32):
+        self.coverage = coverage
+        self.footprints = footprints
+        self.mode = mode
+        self.grid_size = grid_size
+        self.refine_top = refine_top
+        self.max_evals = max_evals
+
+    def find_best_yaw(self, pt, polys):
+        if self.mode == "grid":
+            return self.find_best_yaw_grid(pt, polys)
+        return self.find_best_yaw_bounded(
+            pt, polys, (0.0, 2 * math.pi), self.max_evals)
+
+    def find_best_yaw_bounded(self, pt, polys, bounds, max_evals):
+        init = math.pi
+        args = (list(pt), polys)
+        options = {"disp": False, "maxiter": max_evals}
+        kwargs = {"options": options, "method": "Bounded", "args": args,
+                  "bounds": bounds}
+        opt_res = opt.minimize_scalar(self.yaw_objective, init, **kwargs)
+        return opt_res
+
+    def find_best_yaw_grid(self, pt, polys):
+        num_yaws = self.grid_size
+        if self.max_evals:
+            num_yaws = min(num_yaws, self.max_evals)
+        yaw_step = 2 * math.pi / num_yaws
+        yaws = np.arange(num_yaws) * yaw_step
+        funs = self.yaw_objectives(yaws, list(pt), polys)
+        best_i = np.argmin(funs)
+        best_yaw, best_fun = yaws[best_i], funs[best_i]
+        nfev = num_yaws
+        num_refine = min(self.refine_top, num_yaws)
+        for k, i in enumerate(np.argsort(funs, kind="mergesort")[:num_refine]):
+            budget = self.max_evals - nfev if self.max_evals else None
+            if budget is not None:
+                budget //= num_refine - k
+                if budget < 1:
+                    break
+            bounds = (yaws[i] - yaw_step, yaws[i] + yaw_step)
+            ref_res = self.find_best_yaw_bounded(pt, polys, bounds, budget)
+            nfev += ref_res.nfev
+            if ref_res.fun < best_fun:
+                best_yaw, best_fun = ref_res.x, ref_res.fun
+        return opt.OptimizeResult(x=best_yaw % (2 * math.pi), fun=best_fun,
+                                  nfev=nfev, success=True)
+
+    def yaw_objective(self, yaw, state_2d, polys):
+        state = np.array(state_2d + [yaw])
+        footprint = self.footprints.footprint(state)
+        return -self.coverage.covered_area(polys, footprint)
+
+    def yaw_objectives(self, yaws, state_2d, polys):
+        states = np.empty((len(yaws), 3))
+        states[:, :2] = state_2d
+        states[:, 2] = yaws
+        footprints = self.footprints.footprints(states)
+        return -self.coverage.covered_areas(polys, footprints)